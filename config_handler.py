@@ -82,6 +82,13 @@ class ConfigHandler:
         self.parser["MAIN"]['DisplayWithoutCraftCost'] = 'False'
         self.parser["MAIN"]['GatheringProfitTable'] = 'False'
         self.parser["MAIN"]['EndlessLoop'] = 'False'
+        self.parser["MAIN"]['ApiConcurrency'] = '8'
+        self.parser["MAIN"]['ApiRateLimit'] = '20'
+        self.parser["MAIN"]['ApiBatchSize'] = '100'
+        self.parser["MAIN"]['RefreshMode'] = 'Priority'
+        self.parser["MAIN"]['UniversalisUrl'] = 'https://universalis.app/api/v2'
+        self.parser["MAIN"]['CheckpointItems'] = '500'
+        self.parser["MAIN"]['CheckpointSeconds'] = '60'
 
         self.parser.add_section('LOGGING')
         self.parser['LOGGING']['LogEnable'] = 'True'
@@ -120,7 +127,16 @@ class ConfigHandler:
                     "gathering_profit_table": self.parser["MAIN"].getboolean(
                         'GatheringProfitTable', False)
                 },
-                "endless_loop": self.parser["MAIN"].getboolean('EndlessLoop', False)
+                "endless_loop": self.parser["MAIN"].getboolean('EndlessLoop', False),
+                "api_concurrency": self.parser["MAIN"].getint('ApiConcurrency', 8),
+                "api_rate_limit": self.parser["MAIN"].getint('ApiRateLimit', 20),
+                "api_batch_size": self.parser["MAIN"].getint('ApiBatchSize', 100),
+                "refresh_mode": self.parser["MAIN"].get('RefreshMode', 'Priority').capitalize(),
+                "universalis_url": self.parser["MAIN"].get(
+                    'UniversalisUrl', 'https://universalis.app/api/v2'
+                ).rstrip('/'),
+                "checkpoint_items": self.parser["MAIN"].getint('CheckpointItems', 500),
+                "checkpoint_seconds": self.parser["MAIN"].getint('CheckpointSeconds', 60)
             }
         except Exception as err:
             self.ffxiv_logger.error("MAIN Config was invalid, setting back to defaults: %i", {err})
@@ -133,6 +149,13 @@ class ConfigHandler:
             self.parser["MAIN"]['DisplayWithoutCraftCost'] = 'False'
             self.parser["MAIN"]['GatheringProfitTable'] = 'False'
             self.parser["MAIN"]['EndlessLoop'] = 'False'
+            self.parser["MAIN"]['ApiConcurrency'] = '8'
+            self.parser["MAIN"]['ApiRateLimit'] = '20'
+            self.parser["MAIN"]['ApiBatchSize'] = '100'
+            self.parser["MAIN"]['RefreshMode'] = 'Priority'
+            self.parser["MAIN"]['UniversalisUrl'] = 'https://universalis.app/api/v2'
+            self.parser["MAIN"]['CheckpointItems'] = '500'
+            self.parser["MAIN"]['CheckpointSeconds'] = '60'
             with open(self.configfile, 'w', encoding='utf-8') as configfile:
                 self.parser.write(configfile)
 
@@ -145,7 +168,14 @@ class ConfigHandler:
                 "extra_tables": {
                     "display_without_craft_cost": False,
                     "gathering_profit_table": False
-                }
+                },
+                "api_concurrency": 8,
+                "api_rate_limit": 20,
+                "api_batch_size": 100,
+                "refresh_mode": 'Priority',
+                "universalis_url": 'https://universalis.app/api/v2',
+                "checkpoint_items": 500,
+                "checkpoint_seconds": 60
             }
         self.main_validation()
         self.ffxiv_logger.info("Main Config Loaded")
@@ -241,13 +271,25 @@ class ConfigHandler:
             isinstance(self.config["result_quantity"], int),
             isinstance(self.config["update_quantity"], int),
             isinstance(self.config["extra_tables"]["display_without_craft_cost"], bool),
-            isinstance(self.config["extra_tables"]["gathering_profit_table"], bool)
+            isinstance(self.config["extra_tables"]["gathering_profit_table"], bool),
+            isinstance(self.config["api_concurrency"], int),
+            isinstance(self.config["api_rate_limit"], int),
+            isinstance(self.config["api_batch_size"], int),
+            isinstance(self.config["checkpoint_items"], int),
+            isinstance(self.config["checkpoint_seconds"], int)
         ])
         value_check = all([
             self.config["marketboard_type"] in ["World", "Datacentre", "Datacenter"],
             self.config["datacentre"] in valid_datacentres,
             self.config["world"] in valid_worlds,
-            self.config["result_quantity"] > 0
+            self.config["result_quantity"] > 0,
+            self.config["api_concurrency"] > 0,
+            self.config["api_rate_limit"] > 0,
+            1 <= self.config["api_batch_size"] <= 100,
+            self.config["refresh_mode"] in ["Sequential", "Priority", "Changed"],
+            self.config["universalis_url"].startswith(("http://", "https://")),
+            self.config["checkpoint_items"] > 0,
+            self.config["checkpoint_seconds"] > 0
         ])
         if not type_check and value_check:
             self.ffxiv_logger.error(
@@ -0,0 +1,365 @@
+"""
+Module for resolving multi-level crafting costs for FFXIV-Market-Calculator
+"""
+import heapq
+from collections import defaultdict, deque
+
+from log_handler import LogHandler
+
+
+class CraftResolver:
+    """
+    Class for pricing every item as the cheaper of buying it and crafting it, where
+    crafting uses each ingredient at its own cheapest price.
+
+    The recipes form a dependency graph from ingredients to the items they craft.
+    It is walked once in topological order so every ingredient is resolved before
+    the recipes using it, and each resolved cost is memoized for all of its users.
+    The graph and the memoized costs are kept between cycles, so after a refresh
+    only the items whose price changed and the items built from them, through a
+    reverse index of ingredient to users, are resolved again.
+
+    Attributes:
+    -------
+    ffxiv_logger : Logger object
+        Used for logging functions
+    sentinel : int
+        Cost of an item which can be neither bought nor crafted
+    prices : dict
+        Item number to its market ave_cost, None without usable sales
+    recipes : dict
+        Item number to its [(recipe, amount_result, [(ingredient, amount), ...]), ...]
+    effective_costs : dict
+        Item number to the cheaper of buying and crafting it
+    craft_costs : dict
+        Craftable item number to the cost of crafting one with its cheapest recipe
+    craft_recipes : dict
+        Item number to the recipe it is cheaper to craft with, 0 when buying is cheaper
+    users : dict
+        Reverse index of ingredient item number to the craftable items using it
+    rank : dict
+        Craftable item number to its position in the topological order
+    cycles : dict
+        Item number in a recipe cycle to the first item of its cycle
+    database : tuple
+        Database the kept graph and costs were loaded from, with the data_version
+        stored in the meta table of the attached static database
+
+    Methods:
+    -------
+    load(location_db):
+        Reads the market prices and the recipe graph
+    topological_order():
+        Orders the craftable items so every ingredient comes before its users
+    strongly_connected(item_numbers, depends_on):
+        Splits items into the recipe cycles they form
+    ingredient_cost(item_number, user):
+        Cost of one ingredient, resolved or at market
+    resolve_item(item_number):
+        Resolves the crafting and effective cost of one item
+    changed_prices(location_db, item_numbers):
+        Refreshes the kept prices of items, returning those which changed
+    propagate(changed):
+        Re-resolves only the items affected by changed prices
+    resolve(location_db, item_numbers):
+        Resolves the items and stores the costs and buy/craft choices
+    """
+    sentinel = 9999999
+
+    def __init__(self, logging_config):
+        """
+        Constructs all the necessary attributes for the CraftResolver object.
+
+        Parameters:
+            logging_config : dict
+                The config for logging
+        """
+        self.ffxiv_logger = LogHandler.get_logger(__name__, logging_config)
+        self.prices = {}
+        self.recipes = defaultdict(list)
+        self.effective_costs = {}
+        self.craft_costs = {}
+        self.craft_recipes = {}
+        self.users = defaultdict(set)
+        self.rank = {}
+        self.cycles = {}
+        self.database = None
+
+    def load(self, location_db):
+        """
+        Reads the market prices and the recipe graph.
+
+        Parameters:
+            location_db : SqlManager
+                Database object for performing SQL queries
+        """
+        self.prices = {
+            item_number: ave_cost if isinstance(ave_cost, (int, float)) and ave_cost > 0 else None
+            for item_number, ave_cost in location_db.return_query(
+                "SELECT item_num, ave_cost FROM item"
+            )
+        }
+        ingredients = defaultdict(list)
+        for recipe, item_number, amount in location_db.return_query(
+                "SELECT recipe, item, amount FROM recipe_ingredient"
+        ):
+            ingredients[recipe].append(tuple((item_number, amount)))
+        self.recipes = defaultdict(list)
+        for recipe, item_result, amount_result in location_db.return_query(
+                "SELECT csv_key, item_result, amount_result FROM recipe"
+        ):
+            if ingredients[recipe]:
+                self.recipes[item_result].append(
+                    tuple((recipe, max(amount_result or 1, 1), ingredients[recipe]))
+                )
+
+    def topological_order(self):
+        """
+        Orders the craftable items so every craftable ingredient comes before the
+        items crafted from it (Kahn's algorithm). Items Kahn's algorithm cannot order
+        are split into their recipe cycles, appended after the cycles they depend on.
+        Also builds the reverse index of every ingredient to the items using it.
+        """
+        self.users = defaultdict(set)
+        waiting = {}
+        depends_on = {}
+        for item_number, recipes in self.recipes.items():
+            depends_on[item_number] = {
+                ingredient for _, _, ingredients in recipes for ingredient, _ in ingredients
+                if ingredient in self.recipes and ingredient != item_number
+            }
+            waiting[item_number] = len(depends_on[item_number])
+            for _, _, ingredients in recipes:
+                for ingredient, _ in ingredients:
+                    self.users[ingredient].add(item_number)
+
+        ready = deque(item_number for item_number, count in waiting.items() if count == 0)
+        order = []
+        while ready:
+            item_number = ready.popleft()
+            order.append(item_number)
+            for user in self.users[item_number]:
+                if user == item_number:
+                    continue
+                waiting[user] -= 1
+                if waiting[user] == 0:
+                    ready.append(user)
+
+        self.cycles = {}
+        if len(order) < len(waiting):
+            ordered = set(order)
+            remaining = sorted(item_number for item_number in waiting if item_number not in ordered)
+            for component in self.strongly_connected(remaining, {
+                    item_number: depends_on[item_number] - ordered for item_number in remaining
+            }):
+                if len(component) > 1:
+                    self.cycles.update((item_number, component[0]) for item_number in component)
+                order.extend(component)
+            self.ffxiv_logger.warning(
+                f"{len(self.cycles)} items are in a recipe cycle, their ingredients in the "
+                f"cycle are priced at market"
+            )
+        self.rank = {item_number: position for position, item_number in enumerate(order)}
+        return order
+
+    @staticmethod
+    def strongly_connected(item_numbers, depends_on):
+        """
+        Splits items into the strongly connected components of their dependency graph
+        (Tarjan's algorithm, without recursion), each component listed after the
+        components it depends on and sorted by item number.
+
+        Parameters:
+            item_numbers : list[int]
+                Item numbers to split
+            depends_on : dict
+                Item number to the set of item numbers it is crafted from
+        """
+        index, low, stack, on_stack, components = {}, {}, [], set(), []
+        for root in item_numbers:
+            if root in index:
+                continue
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [tuple((root, iter(sorted(depends_on[root]))))]
+            while work:
+                item_number, ingredients = work[-1]
+                for ingredient in ingredients:
+                    if ingredient not in index:
+                        index[ingredient] = low[ingredient] = len(index)
+                        stack.append(ingredient)
+                        on_stack.add(ingredient)
+                        work.append(tuple((ingredient, iter(sorted(depends_on[ingredient])))))
+                        break
+                    if ingredient in on_stack:
+                        low[item_number] = min(low[item_number], index[ingredient])
+                else:
+                    work.pop()
+                    if work:
+                        low[work[-1][0]] = min(low[work[-1][0]], low[item_number])
+                    if low[item_number] == index[item_number]:
+                        component = []
+                        while not component or component[-1] != item_number:
+                            component.append(stack.pop())
+                            on_stack.discard(component[-1])
+                        components.append(sorted(component))
+        return components
+
+    def ingredient_cost(self, item_number, user=None):
+        """
+        Cost of one ingredient, its resolved cost if already resolved, else its
+        market price or the sentinel when it has no sales. An ingredient of its own
+        recipe or from the same recipe cycle as the user is always priced at market,
+        so the cost does not depend on the order the cycle was resolved in.
+
+        Parameters:
+            item_number : int
+                Item number of the ingredient
+            user : int
+                Item number crafted from the ingredient, None outside of a recipe
+        """
+        in_cycle = item_number == user or \
+            (item_number in self.cycles and self.cycles[item_number] == self.cycles.get(user))
+        if item_number in self.effective_costs and not in_cycle:
+            return self.effective_costs[item_number]
+        price = self.prices.get(item_number)
+        return self.sentinel if price is None else price
+
+    def resolve_item(self, item_number):
+        """
+        Resolves the crafting cost of one unit of an item with its cheapest recipe and
+        its effective cost as the cheaper of that and buying it. All of its craftable
+        ingredients must already be resolved.
+
+        Parameters:
+            item_number : int
+                Item number to resolve
+        """
+        best_recipe, best_cost = 0, None
+        for recipe, amount_result, ingredients in self.recipes[item_number]:
+            cost = sum(amount * self.ingredient_cost(ingredient, item_number)
+                       for ingredient, amount in ingredients) / amount_result
+            if best_cost is None or cost < best_cost:
+                best_recipe, best_cost = recipe, cost
+        price = self.prices.get(item_number)
+        self.craft_costs[item_number] = best_cost
+        if price is not None and price <= best_cost:
+            self.effective_costs[item_number] = price
+            self.craft_recipes[item_number] = 0
+        elif best_cost < self.sentinel:
+            self.effective_costs[item_number] = best_cost
+            self.craft_recipes[item_number] = best_recipe
+        else:
+            # neither sold nor craftable from obtainable ingredients
+            self.effective_costs[item_number] = self.sentinel
+            self.craft_recipes[item_number] = 0
+
+    def changed_prices(self, location_db, item_numbers):
+        """
+        Refreshes the kept market prices of the given items and returns the set
+        of those whose price changed.
+
+        Parameters:
+            location_db : SqlManager
+                Database object for performing SQL queries
+            item_numbers : list[int]
+                Item numbers which may have a new ave_cost
+        """
+        changed = set()
+        item_numbers = list(item_numbers)
+        # sized to stay under the SQLite bound variable limit
+        for i in range(0, len(item_numbers), 500):
+            batch = item_numbers[i:i + 500]
+            for item_number, ave_cost in location_db.return_query(
+                    f"SELECT item_num, ave_cost FROM item "
+                    f"WHERE item_num IN ({','.join('?' * len(batch))})", batch
+            ):
+                price = ave_cost if isinstance(ave_cost, (int, float)) and ave_cost > 0 \
+                    else None
+                if price != self.prices.get(item_number):
+                    self.prices[item_number] = price
+                    changed.add(item_number)
+        return changed
+
+    def propagate(self, changed):
+        """
+        Re-resolves the items affected by changed prices and returns every item
+        whose stored costs may differ. Items are visited in topological order and a
+        user is only queued when the effective cost of one of its ingredients moved,
+        or the market price of one which it prices at market in a recipe cycle, so
+        the work follows what changed rather than the catalogue size.
+
+        Parameters:
+            changed : set
+                Item numbers whose market price changed
+        """
+        affected = set(changed)
+        queue = []
+        queued = set()
+
+        def push_users(item_number):
+            for user in self.users.get(item_number, ()):
+                if user not in queued:
+                    queued.add(user)
+                    heapq.heappush(queue, (self.rank[user], user))
+
+        for item_number in changed:
+            if item_number in self.rank and item_number not in queued:
+                queued.add(item_number)
+                heapq.heappush(queue, (self.rank[item_number], item_number))
+            push_users(item_number)
+        while queue:
+            _, item_number = heapq.heappop(queue)
+            previous = self.effective_costs.get(item_number)
+            self.resolve_item(item_number)
+            affected.add(item_number)
+            if self.effective_costs[item_number] != previous:
+                push_users(item_number)
+        return affected
+
+    def resolve(self, location_db, item_numbers=None):
+        """
+        Resolves the items over the recipe graph and stores the cost to craft one
+        unit, the effective cost and the chosen recipe (0 = buy) per item. Only the
+        items affected by the given refreshed items are resolved once the graph has
+        been loaded, otherwise every item is resolved in one pass.
+
+        Parameters:
+            location_db : SqlManager
+                Database object for performing SQL queries
+            item_numbers : list[int]
+                Item numbers refreshed since the last resolve, None to resolve all
+        """
+        # the static data_version is bumped when a refresh changed the items or recipes
+        database = tuple((location_db.database, location_db.return_query(
+            "SELECT value FROM static.meta WHERE key = 'data_version'"
+        )))
+        if item_numbers is None or self.database != database:
+            self.load(location_db)
+            self.database = database
+            self.effective_costs = {}
+            self.craft_costs = {}
+            self.craft_recipes = {}
+            for item_number in self.topological_order():
+                self.resolve_item(item_number)
+            affected = self.prices
+        else:
+            affected = self.propagate(self.changed_prices(location_db, item_numbers))
+
+        update_list = [
+            tuple((round(self.craft_costs.get(item_number, 0)),
+                   round(self.ingredient_cost(item_number)),
+                   self.craft_recipes.get(item_number, 0),
+                   item_number))
+            for item_number in affected if item_number in self.prices
+        ]
+        location_db.execute_query_many(
+            "UPDATE item SET cost_to_craft = ?, effective_cost = ?, craft_recipe = ? "
+            "WHERE item_num = ?", update_list
+        )
+        crafted = sum(1 for recipe in self.craft_recipes.values() if recipe)
+        self.ffxiv_logger.info(
+            f"Resolved {len(update_list)} items, {crafted} of {len(self.craft_costs)} "
+            f"craftable items cheaper to craft"
+        )
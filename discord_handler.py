@@ -1,13 +1,123 @@
 """
 Module for handling all discord api functions for FFXIV-Market-Calculator
 """
+import hashlib
 import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+
+from http_handler import HttpHandler
 from log_handler import LogHandler
 
 
+class RateLimitBucket:
+    """
+    Class for following the rate limit bucket Discord advertises on every webhook
+    response, shared by all in-flight requests.
+
+    Until the first response tells the size of the bucket only one request is let
+    through. From then on up to X-RateLimit-Remaining requests are made before
+    waiting for the X-RateLimit-Reset-After of the window. Each request is tagged
+    with the window it was let through in, so a late response from an earlier
+    window can't reopen the current one.
+
+    Attributes:
+    -------
+    limit : int
+        Requests allowed per window, 1 until Discord advertises it
+    remaining : int
+        Requests still allowed in the current window
+    reset_at : float
+        Monotonic time the current window resets, None while unknown
+    window : int
+        Number of the current window
+    condition : Condition object
+        Guards the bucket and wakes the waiting requests
+
+    Methods:
+    -------
+    acquire():
+        Waits until the bucket allows a request and reserves it
+    update(headers, window):
+        Takes the bucket state advertised by a response
+    pause(seconds):
+        Holds every request for the given time after a 429
+    """
+    def __init__(self):
+        """
+        Constructs all the necessary attributes for the RateLimitBucket object.
+        """
+        self.limit = 1
+        self.remaining = 1
+        self.reset_at = None
+        self.window = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Reserves a request within the bucket, sleeping until the window resets or a
+        response tells the bucket size if none is left. Returns the window the
+        request was let through in.
+        """
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if self.reset_at is not None and now >= self.reset_at:
+                    self.remaining = self.limit
+                    self.reset_at = None
+                    self.window += 1
+                if self.remaining > 0:
+                    self.remaining -= 1
+                    return self.window
+                self.condition.wait(None if self.reset_at is None else self.reset_at - now)
+
+    def update(self, headers, window):
+        """
+        Takes the bucket state advertised by a response to a request of the current
+        window. Its responses may arrive out of order, so the lowest remaining count
+        is kept.
+
+        Parameters:
+            headers : dict
+                Headers of the response, empty when the request failed
+            window : int
+                Window the request was let through in
+        """
+        with self.condition:
+            try:
+                limit = int(headers["X-RateLimit-Limit"])
+                remaining = int(headers["X-RateLimit-Remaining"])
+                reset_at = time.monotonic() + float(headers["X-RateLimit-Reset-After"])
+            except (KeyError, ValueError):
+                # nothing advertised, let the next request through to learn the bucket
+                if self.reset_at is None:
+                    self.remaining = max(self.remaining, 1)
+            else:
+                if window == self.window:
+                    first = self.limit == 1 and self.reset_at is None and window == 0
+                    self.limit = limit
+                    self.remaining = remaining if first else min(self.remaining, remaining)
+                    self.reset_at = reset_at
+            self.condition.notify_all()
+
+    def pause(self, seconds):
+        """
+        Holds every request until the given time has passed, after a 429.
+
+        Parameters:
+            seconds : float
+                retry_after of the rate limited response
+        """
+        with self.condition:
+            self.remaining = 0
+            self.reset_at = max(self.reset_at or 0, time.monotonic() + seconds)
+            self.condition.notify_all()
+
+
 class DiscordHandler:
     """
     Class for handling the script discord api calls.
@@ -24,23 +134,53 @@ class DiscordHandler:
         Global database to store shared values
     webhook_base : str
         Base url for the Discord Webhook calls
+    stale_after : int
+        Seconds after which an unchanged message is sent again to refresh its time
+    concurrency : int
+        Maximum number of messages being delivered at once
+    max_attempts : int
+        Attempts at a rate limited (429) call before giving up
+    bucket : RateLimitBucket object
+        Rate limit shared by every webhook call
 
     Methods:
     -------
+    send(method, url, data):
+        Makes a webhook call within the rate limit, retrying rate limited calls
     discord_message_create(data):
         Creates a new Discord Message
     discord_message_update(message_id, data):
         Updates existing Discord Message/s
+    content_hash(data):
+        Hashes the message data without its update time
+    discord_queue_handler(message):
+        Processes the message queue through create or update
+    deliver(messages):
+        Delivers the messages concurrently, reporting each outcome
     """
-    def __init__(self, logging_config):
+    stale_after = 3600
+    concurrency = 10
+    max_attempts = 5
+
+    def __init__(self, logging_config, global_db=None):
         """
         Constructs all the necessary attributes for the DiscordHandler object.
 
         Parameters:
             logging_config : dict
                 The config for logging
+            global_db : SqlManager
+                Global database keeping what each message was last updated with,
+                every message is sent when None
         """
         self.ffxiv_logger = LogHandler.get_logger(__name__, logging_config)
+        self.bucket = RateLimitBucket()
+        self.global_db = global_db
+        if self.global_db is not None:
+            self.global_db.execute_query(
+                "CREATE TABLE IF NOT EXISTS discord_message (message_id TEXT PRIMARY KEY, "
+                "content_hash TEXT NOT NULL, sent_time INTEGER NOT NULL)"
+            )
         self.discord_id = os.getenv('DISCORDID')
         self.discord_token = os.getenv('DISCORDTOKEN')
         self.ffxiv_logger.debug(f'{str(self.discord_token)} {str(self.discord_id)}')
@@ -55,6 +195,45 @@ class DiscordHandler:
         self.webhook_base = f"https://discord.com/api/webhooks/" \
                             f"{self.discord_id}/{self.discord_token}"
 
+    def send(self, method, url, data):
+        """
+        Makes a webhook call once the rate limit bucket allows it. A rate limited
+        (429) call waits its retry_after and is tried again. Returns the response,
+        None when the call failed.
+
+        Parameters:
+            method : str
+                Http method to use
+            url : str
+                url to perform the http request on
+            data : str
+                Message data to be sent to the Discord Webhook
+        """
+        response = None
+        for _ in range(self.max_attempts):
+            window = self.bucket.acquire()
+            try:
+                # 429s come straight back so only the bucket decides how long to wait
+                response = HttpHandler.request(method, url, retry_rate_limits=False,
+                                               data=json.dumps({"content": data}),
+                                               headers={'content-type': 'application/json'})
+            except requests.RequestException as err:
+                self.bucket.update({}, window)
+                self.ffxiv_logger.error(f"Discord webhook call failed: {err}")
+                return None
+            self.bucket.update(response.headers, window)
+            self.ffxiv_logger.debug(f'{str(response.status_code)} {response.text} '
+                                    f'{response.request.url}')
+            if response.status_code != 429:
+                break
+            try:
+                retry_after = float(response.json()["retry_after"])
+            except (ValueError, KeyError, TypeError):
+                retry_after = float(response.headers.get("Retry-After", 1))
+            self.ffxiv_logger.warning(f"Discord rate limited, retrying after {retry_after}s")
+            self.bucket.pause(retry_after)
+        return response
+
     def discord_message_create(self, data):
         """
         Calls the Discord Webhook API to create a new message.
@@ -64,11 +243,7 @@ class DiscordHandler:
                 Message data to be sent to the Discord Webhook
         """
         self.ffxiv_logger.info("Creating new discord message")
-        response = requests.post(self.webhook_base, json.dumps({"content": data}),
-                                 headers={'content-type': 'application/json'})
-        self.ffxiv_logger.debug(f'{str(response.status_code)} {response.text} '
-                                f'{response.request.url}')
-        self.ffxiv_logger.info("Discord message sent")
+        return self.send("POST", self.webhook_base, data)
 
     def discord_message_update(self, message_id, data):
         """
@@ -82,16 +257,26 @@ class DiscordHandler:
         """
         self.ffxiv_logger.info("Updating discord message")
         webhook_path = f"{self.webhook_base}/messages/"
-        response = requests.patch(f"{webhook_path}{str(message_id)}",
-                                  json.dumps({"content": data}),
-                                  headers={'content-type': 'application/json'})
-        self.ffxiv_logger.debug(f'{str(response.status_code)} {response.text} '
-                                f'{response.request.url}')
-        self.ffxiv_logger.info("Discord message updated")
+        return self.send("PATCH", f"{webhook_path}{str(message_id)}", data)
+
+    @staticmethod
+    def content_hash(data):
+        """
+        Hashes the message data without the update time in its header line, so only
+        a change of the ranking changes the hash.
+
+        Parameters:
+            data : str
+                Message data to be sent to the Discord Webhook
+        """
+        header, _, table = data.partition("\n")
+        header = header.rsplit(" @ ", 1)[0]
+        return hashlib.sha256(f"{header}\n{table}".encode("utf-8")).hexdigest()
 
     def discord_queue_handler(self, message):
         """
-        Processes the message queue through create or update.
+        Processes the message queue through create or update, returning the outcome
+        of the message: "created", "updated", "unchanged" or "failed <status>".
 
         Parameters:
             message : tuple
@@ -99,6 +284,59 @@ class DiscordHandler:
         """
         self.ffxiv_logger.debug(message)
         if message[0] == 0:
-            self.discord_message_create(message[1])
-        else:
-            self.discord_message_update(message[0], message[1])
+            response = self.discord_message_create(message[1])
+            if response is not None and response.status_code in (200, 204):
+                return "created"
+            return f"failed {getattr(response, 'status_code', 'without response')}"
+
+        content_hash = None
+        if self.global_db is not None:
+            content_hash = self.content_hash(message[1])
+            last_sent = self.global_db.return_query(
+                "SELECT content_hash, sent_time FROM discord_message WHERE message_id = ?",
+                [str(message[0])]
+            )
+            # an unchanged ranking is only sent again once its shown time has gone stale
+            if last_sent and last_sent[0][0] == content_hash and \
+                    time.time() - last_sent[0][1] < self.stale_after:
+                return "unchanged"
+        response = self.discord_message_update(message[0], message[1])
+        if response is None or response.status_code != 200:
+            return f"failed {getattr(response, 'status_code', 'without response')}"
+        if content_hash is not None:
+            self.global_db.execute_query(
+                "INSERT OR REPLACE INTO discord_message (message_id, content_hash, sent_time) "
+                "VALUES (?, ?, ?)", [str(message[0]), content_hash, int(time.time())]
+            )
+        return "updated"
+
+    def deliver(self, messages):
+        """
+        Delivers the messages concurrently, as many at once as the rate limit bucket
+        allows, and logs the outcome and latency of each. Returns the outcomes in
+        message order.
+
+        Parameters:
+            messages : list[tuple]
+                Message ID and message data of each message
+        """
+        def timed(message):
+            start = time.monotonic()
+            outcome = self.discord_queue_handler(message)
+            return outcome, time.monotonic() - start
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = list(executor.map(timed, messages))
+        for message, (outcome, latency) in zip(messages, results):
+            log = self.ffxiv_logger.error if outcome.startswith("failed") \
+                else self.ffxiv_logger.info
+            log(f"Discord message {message[0]} {outcome} in {latency:.2f}s")
+        outcomes = [outcome for outcome, _ in results]
+        self.ffxiv_logger.info(
+            f"Delivered {len(messages)} Discord messages in {time.monotonic() - start:.2f}s, "
+            f"{outcomes.count('updated') + outcomes.count('created')} sent, "
+            f"{outcomes.count('unchanged')} unchanged, "
+            f"{sum(outcome.startswith('failed') for outcome in outcomes)} failed"
+        )
+        return outcomes
@@ -0,0 +1,266 @@
+"""
+Module for exporting the market data of FFXIV-Market-Calculator
+"""
+import csv
+import json
+import os
+import re
+
+from log_handler import LogHandler
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # only needed for Parquet exports
+    pyarrow = None
+
+
+class ExportHandler:
+    """
+    Class for streaming the full item and recipe metrics of location databases
+    to CSV, JSON Lines or Parquet files.
+
+    Rows are read from the SQLite cursor and written chunk by chunk, so memory
+    stays bounded by the chunk size whatever the size of the database. Each
+    file is written aside and swapped in once complete.
+
+    Attributes:
+    -------
+    ffxiv_logger : Logger object
+        Used for logging functions
+    export_dir : str
+        Directory the exported files are written to
+    export_format : str
+        One of formats
+    chunk_size : int
+        Rows read from the cursor at a time
+    formats : tuple
+        Supported export formats, also the file extensions
+    queries : dict
+        Name of each export to the query it is read with, {item_columns} is filled
+        in per database
+
+    Methods:
+    -------
+    location_databases(directory):
+        Lists the location databases in a directory
+    export(location_db):
+        Exports every query of a location database
+    item_columns(location_db):
+        Lists the item columns of a location database for a select
+    write_csv(path, columns, chunks):
+        Streams rows to a CSV file
+    write_jsonl(path, columns, chunks):
+        Streams rows to a JSON Lines file
+    write_parquet(path, columns, chunks, types):
+        Streams rows to a Parquet file
+    column_types(location_db, query, columns):
+        Finds the Parquet type of each column
+    """
+    formats = ("csv", "jsonl", "parquet")
+    queries = {
+        "item": (
+            "SELECT {item_columns}, item_info.name AS name FROM item "
+            "LEFT JOIN static.item_info ON item_info.item_num = item.item_num "
+            "ORDER BY item.item_num"
+        ),
+        "recipe": (
+            "SELECT recipe.csv_key AS recipe, recipe.item_result, recipe.amount_result, "
+            "recipe.craft_type, recipe.recipe_level_table, "
+            "COUNT(recipe_ingredient.item) AS ingredients, "
+            "SUM(recipe_ingredient.amount * ingredient.effective_cost) AS ingredient_cost, "
+            "SUM(recipe_ingredient.item IS NOT NULL AND ingredient.effective_cost IS NULL) "
+            "AS unpriced_ingredients, "
+            "COALESCE(result.craft_recipe = recipe.csv_key, 0) AS chosen "
+            "FROM static.recipe "
+            "LEFT JOIN static.recipe_ingredient ON recipe_ingredient.recipe = recipe.csv_key "
+            "LEFT JOIN item AS ingredient ON ingredient.item_num = recipe_ingredient.item "
+            "LEFT JOIN item AS result ON result.item_num = recipe.item_result "
+            "GROUP BY recipe.csv_key ORDER BY recipe.csv_key"
+        )
+    }
+
+    def __init__(self, logging_config, export_dir, export_format, chunk_size=5000):
+        """
+        Constructs all the necessary attributes for the ExportHandler object.
+
+        Parameters:
+            logging_config : dict
+                The config for logging
+            export_dir : str
+                Directory the exported files are written to
+            export_format : str
+                One of formats
+            chunk_size : int
+                Rows read from the cursor at a time
+        """
+        self.ffxiv_logger = LogHandler.get_logger(__name__, logging_config)
+        if export_format not in self.formats:
+            raise ValueError(f"Export format must be one of {', '.join(self.formats)}")
+        if export_format == "parquet" and pyarrow is None:
+            raise ValueError("Parquet exports need pyarrow, install it with pip install pyarrow")
+        self.export_dir = export_dir
+        self.export_format = export_format
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def location_databases(directory):
+        """
+        Lists the World/DC databases in a directory
+
+        Parameters:
+            directory : str
+                Directory holding the databases
+        """
+        return sorted(
+            os.path.join(directory, file_name) for file_name in os.listdir(directory)
+            if re.fullmatch(r"(World|Datacentre|Datacenter)_[^.]+", file_name)
+            and not file_name.endswith(("-wal", "-shm", "-journal"))
+        )
+
+    def export(self, location_db):
+        """
+        Exports every query of a location database to its own file, named after the
+        database and the query, and returns the paths written
+
+        Parameters:
+            location_db : SqlManager
+                Location database with the static database attached
+        """
+        os.makedirs(self.export_dir, exist_ok=True)
+        paths = []
+        item_columns = self.item_columns(location_db)
+        for name, query in self.queries.items():
+            query = query.format(item_columns=item_columns)
+            path = os.path.join(
+                self.export_dir,
+                f"{os.path.basename(location_db.database)}_{name}.{self.export_format}"
+            )
+            columns, chunks = location_db.stream_query(query, chunk_size=self.chunk_size)
+            if self.export_format == "csv":
+                self.write_csv(path + ".part", columns, chunks)
+            elif self.export_format == "jsonl":
+                self.write_jsonl(path + ".part", columns, chunks)
+            else:
+                types = self.column_types(location_db, query, columns)
+                self.write_parquet(path + ".part", columns, chunks, types)
+            os.replace(path + ".part", path)
+            self.ffxiv_logger.info(f"Exported {name} of {location_db.database} to {path}")
+            paths.append(path)
+        return paths
+
+    @staticmethod
+    def item_columns(location_db):
+        """
+        Lists the columns of the item table for a select, generated metrics included,
+        leaving out the name column databases from the old layout still hold as the
+        name is taken from the static item_info table
+
+        Parameters:
+            location_db : SqlManager
+                Location database with the static database attached
+        """
+        # table_info leaves out generated columns, table_xinfo marks them hidden 2 or 3
+        columns = location_db.return_query("PRAGMA table_xinfo(item)")
+        return ", ".join(
+            f"item.\"{column[1]}\"" for column in columns
+            if column[1] != "name" and column[6] != 1
+        )
+
+    @staticmethod
+    def write_csv(path, columns, chunks):
+        """
+        Streams rows to a CSV file with a header row
+
+        Parameters:
+            path : str
+                File to write
+            columns : list
+                Column names
+            chunks : iterator
+                Chunks of rows
+        """
+        with open(path, "w", newline="", encoding="utf-8") as export_file:
+            writer = csv.writer(export_file)
+            writer.writerow(columns)
+            for rows in chunks:
+                writer.writerows(rows)
+
+    @staticmethod
+    def write_jsonl(path, columns, chunks):
+        """
+        Streams rows to a JSON Lines file, one object per row
+
+        Parameters:
+            path : str
+                File to write
+            columns : list
+                Column names
+            chunks : iterator
+                Chunks of rows
+        """
+        with open(path, "w", encoding="utf-8") as export_file:
+            for rows in chunks:
+                export_file.writelines(
+                    json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n"
+                    for row in rows
+                )
+
+    @staticmethod
+    def write_parquet(path, columns, chunks, types):
+        """
+        Streams rows to a Parquet file, one row group per chunk
+
+        Parameters:
+            path : str
+                File to write
+            columns : list
+                Column names
+            chunks : iterator
+                Chunks of rows
+            types : list
+                pyarrow type of each column
+        """
+        schema = pyarrow.schema(list(zip(columns, types)))
+        with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+            for rows in chunks:
+                arrays = []
+                for column, column_type in enumerate(types):
+                    values = [row[column] for row in rows]
+                    if column_type == pyarrow.string():
+                        # a text column may also hold numbers
+                        values = [None if value is None else str(value) for value in values]
+                    arrays.append(pyarrow.array(values, type=column_type))
+                writer.write_batch(pyarrow.record_batch(arrays, schema=schema))
+
+    @staticmethod
+    def column_types(location_db, query, columns):
+        """
+        Finds the pyarrow type of each column from the SQLite types of its values,
+        as a column of an expression can hold values of several storage classes.
+        Text wins over real, real over integer, and a column of only NULLs is text.
+
+        Parameters:
+            location_db : SqlManager
+                Location database with the static database attached
+            query : str
+                Query the columns are read with
+            columns : list
+                Column names
+        """
+        checks = ", ".join(
+            f"MAX(typeof(\"{column}\") = 'text'), MAX(typeof(\"{column}\") = 'real'), "
+            f"MAX(typeof(\"{column}\") = 'integer')"
+            for column in columns
+        )
+        found = location_db.return_query(f"SELECT {checks} FROM ({query})")[0]
+        types = []
+        for column in range(len(columns)):
+            text, real, integer = found[column * 3:column * 3 + 3]
+            if text or not (real or integer):
+                types.append(pyarrow.string())
+            elif real:
+                types.append(pyarrow.float64())
+            else:
+                types.append(pyarrow.int64())
+        return types
@@ -1,40 +1,41 @@
 """
 Module to perform initial database creation/population for FFXIV-Market-Calculator
 """
+import csv
+import json
 import os
 import pathlib
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 
+from http_handler import HttpHandler
 from sql_helpers import SqlManager
 
+DATAMINING_URL = "https://raw.githubusercontent.com/xivapi/ffxiv-datamining/master/csv/"
+
 
 def filter_marketable_items(items, marketable_ids):
     """
     Filters items to only marketable items
     Parameters:
-        items : list
-            Raw item data from api
-        marketable_ids : list
+        items : iterator
+            Parsed rows of the raw item data from api, header rows first
+        marketable_ids : set
             Marketable item IDs
     """
-    marketable_items = [None, (
-        'item_num', 'name', 'ave_cost', 'regular_sale_velocity', 'ave_nq_cost', 'nq_sale_velocity',
-        'ave_hq_cost', 'hq_sale_velocity', 'gatherable'), (
-        'INTEGER PRIMARY KEY', 'TEXT', 'INTEGER', 'REAL', 'INTEGER', 'REAL',
-        'INTEGER', 'REAL', 'TEXT DEFAULT "False" NOT NULL')]
-    line_concatenate = []
-    for line in items[3:]:
-        split_line = line_concatenate + line.split(',')
-        if len(split_line) >= 98:
-            line_concatenate = []
-            if split_line[0] in marketable_ids:
-                marketable_items.append((split_line[0], split_line[len(split_line) - 88],
-                                         0, 0, 0, 0, 0, 0, 'False'))
-        else:
-            line_concatenate = split_line
-    return marketable_items
+    next(items)
+    name_column = next(items).index('Name')
+    next(items)
+    column_names = ('item_num', 'name', 'gatherable')
+    data_types = ('INTEGER PRIMARY KEY', 'TEXT', 'TEXT DEFAULT "False" NOT NULL')
+    marketable_items = (
+        (row[0], row[name_column], 'False')
+        for row in items if row and row[0] in marketable_ids
+    )
+    return column_names, data_types, marketable_items
 
 
 class FfxivDbCreation:
@@ -45,15 +46,51 @@ class FfxivDbCreation:
     -------
     database : SqlManager object
         SqlManager object for database operations
+    static_db : str
+        Path of the static game data database shared by every location
+    mirror_dir : str
+        Directory holding the local copy of every downloaded source file
+    sources : dict
+        Name to the url of every source file
+    static_sources : tuple
+        Sources of the static database, in the order they are read
+    global_sources : tuple
+        Sources of the global database, in the order they are read
+    _downloads : dict
+        url to the Future of each prefetched source file not yet read
+    _mirror_lock : Lock object
+        Guards the prefetched downloads and the mirror index across threads
 
     Methods:
     -------
+    static_db_create():
+        Creates a new database for static game data
+    static_db_refresh():
+        Updates the static game data in place from the latest source files
+    static_db_upgrade(database):
+        Brings an existing static database up to the current schema
+    fill_recipe_ingredients(database, recipes):
+        Unpacks recipes into the recipe_ingredient table
     market_db_create():
         Creates a new database for market data
+    market_db_upgrade(database):
+        Brings an existing market database up to the current schema
     global_db_create():
         Creates a new database for global data
+    global_db_refresh():
+        Updates the global data in place from the latest source files
+    mirror_url(url):
+        Revalidates the local copy of a source file, downloading it if changed
+    read_mirror_index(index_path):
+        Reads the validators of every mirrored source file
+    prefetch(urls):
+        Starts mirroring the source files in the background
+    mirror_path(url):
+        Returns the path of the local copy of a source file
     get_data_from_url():
         Retrieves data from web api
+    get_csv_rows():
+        Streams the parsed rows of a CSV from web api
     get_marketable_ids():
         Retrieves data for marketable items
     filter_marketable_recipes():
@@ -65,9 +102,28 @@ class FfxivDbCreation:
     base_state_table():
         Creates the base templated state table
     csv_to_db():
-        Handles writing all data from other methods to the databases
+        Handles streaming all data from other methods into the databases
+    stage_table(csv_data, table_name):
+        Loads the latest rows of a table into a temporary copy of it
+    merge_staged_table(table_name, key):
+        Applies only the inserted, changed or removed rows of a staged table
     """
-    def __init__(self, db_name):
+    static_db = os.path.join("databases", "static_db")
+    mirror_dir = os.path.join("databases", "mirror")
+    sources = {
+        "marketable": "https://universalis.app/api/marketable",
+        "item": DATAMINING_URL + "Item.csv",
+        "recipe": DATAMINING_URL + "Recipe.csv",
+        "gathering": DATAMINING_URL + "GatheringItem.csv",
+        "datacentre": DATAMINING_URL + "WorldDCGroupType.csv",
+        "world": DATAMINING_URL + "World.csv"
+    }
+    static_sources = ("marketable", "item", "gathering", "recipe")
+    global_sources = ("datacentre", "world")
+    _downloads = {}
+    _mirror_lock = threading.Lock()
+
+    def __init__(self, db_name, refresh=False):
         """
         pulls data from the universalis API to limit items to marketable items
         pulls data from:
@@ -76,71 +132,177 @@ class FfxivDbCreation:
             Recipe.csv to get recipe data
             WorldDCGroupType.csv to get dc data
             World.csv to get world data
-        creates a new database w/ the given name if it doesn't exist
+        creates a new database w/ the given name if it doesn't exist,
+        market databases attach the static database which must already exist
         Parameters:
             db_name : str
                 The name that the database should be called
+            refresh : bool
+                Update an existing static or global database in place instead
         """
-        if os.path.exists(pathlib.Path(__file__).parent / db_name):
+        exists = os.path.exists(pathlib.Path(__file__).parent / db_name)
+        if exists and not refresh:
             raise ValueError("Database with that name already exists")
 
-        self.database = SqlManager(db_name)
-
-        if db_name == os.path.join("databases", "global_db"):
-            self.global_db_create()
+        if db_name in (os.path.join("databases", "global_db"), self.static_db):
+            self.database = SqlManager(db_name)
         else:
-            self.market_db_create()
-
-    def market_db_create(self):
+            self.database = SqlManager(db_name, {"static": self.static_db})
+
+        if exists:
+            # the whole refresh is one transaction, so a failed one leaves the data as it was
+            with self.database.transaction():
+                if db_name == os.path.join("databases", "global_db"):
+                    self.global_db_refresh()
+                elif db_name == self.static_db:
+                    self.static_db_refresh()
+            return
+
+        # a half built database is discarded anyway, so only sync once it is complete
+        self.database.execute_query("PRAGMA synchronous=OFF")
+        with self.database.transaction():
+            if db_name == os.path.join("databases", "global_db"):
+                self.global_db_create()
+            elif db_name == self.static_db:
+                self.static_db_create()
+            else:
+                self.market_db_create()
+        self.database.execute_query(f"PRAGMA synchronous={SqlManager.pragmas['synchronous']}")
+
+    def static_db_create(self):
         """
-        Creates the blank market data database
+        Creates the static game data database shared by every location
         """
-        # gets a list of integers in string format ['2','3','5','6',...]
+        self.prefetch([self.sources[source] for source in self.static_sources])
+        # gets a set of integers in string format {'2','3','5','6',...}
         marketable_ids = self.get_marketable_ids()
         print('Got marketable ID list')
 
-        # gets a list of tuples containing the item data
-        # index 0-2 are the column numbers, titles, and data types; index 3+ is the data
-        items = self.get_data_from_url(
-            'https://raw.githubusercontent.com/xivapi/ffxiv-datamining/master/csv/Item.csv'
-        )
-        print('Got raw item CSV')
-
-        # gets a list of tuples containing the item data
-        # index 0-2 are the column numbers, titles, and data types; index 3+ is the data
-        recipes = self.get_data_from_url(
-            'https://raw.githubusercontent.com/xivapi/ffxiv-datamining/master/csv/Recipe.csv')
-        recipes[1] = recipes[1].replace('#', 'CSVkey')
-        print('Got raw recipe CSV')
+        # streams the item rows, rows 0-2 are the column numbers, titles, and data types
+        items = self.get_csv_rows(self.sources["item"])
+        self.csv_to_db(filter_marketable_items(items, marketable_ids), 'item_info')
+        print('item_info table created from marketable items')
 
-        marketable_items = filter_marketable_items(items, marketable_ids)
-        print('item CSV filtered to only marketable')
-
-        marketable_recipes = self.filter_marketable_recipes(recipes, marketable_ids)
-        print('recipes CSV filtered to only marketable')
+        self.add_gatherable()
+        print("gatherable flags added to item_info table")
 
-        self.csv_to_db(marketable_items, 'item')
-        print('item table created')
+        # streams the recipe rows, rows 0-2 are the column numbers, titles, and data types
+        recipes = self.get_csv_rows(self.sources["recipe"])
+        self.csv_to_db(self.filter_marketable_recipes(recipes, marketable_ids), 'recipe')
+        print('recipe table created from marketable recipes')
 
-        self.add_gatherable()
-        print("gatherable flags added to item table")
+        self.static_db_upgrade(self.database)
+        print('recipe_ingredient table created')
 
-        self.csv_to_db(marketable_recipes, 'recipe')
-        print('recipe table created')
+    def static_db_refresh(self):
+        """
+        Updates the static game data in place from the latest source files, only the
+        inserted, changed or removed rows are written
+        """
+        self.prefetch([self.sources[source] for source in self.static_sources])
+        marketable_ids = self.get_marketable_ids()
+        print('Got marketable ID list')
 
-        for i in range(10):
+        items = self.get_csv_rows(self.sources["item"])
+        self.stage_table(filter_marketable_items(items, marketable_ids), 'item_info')
+        self.add_gatherable('staged_item_info')
+        changed, removed = self.merge_staged_table('item_info', 'item_num')
+        print(f'item_info table refreshed, {len(changed)} items added or changed, '
+              f'{len(removed)} removed')
+        items_changed = bool(changed or removed)
+
+        recipes = self.get_csv_rows(self.sources["recipe"])
+        self.stage_table(self.filter_marketable_recipes(recipes, marketable_ids), 'recipe')
+        changed, removed = self.merge_staged_table('recipe', 'csv_key')
+        self.fill_recipe_ingredients(self.database, changed | removed)
+        print(f'recipe table refreshed, {len(changed)} recipes added or changed, '
+              f'{len(removed)} removed')
+
+        # lets running processes see that their loaded items/recipes are out of date
+        if items_changed or changed or removed:
             self.database.execute_query(
-                f"ALTER TABLE recipe ADD ingredient_cost_{i} INTEGER DEFAULT 9999999;"
+                "UPDATE meta SET value = value + 1 WHERE key = 'data_version'"
             )
 
-        self.database.execute_query(
-            "ALTER TABLE recipe ADD cost_to_craft GENERATED ALWAYS AS ("
-            "amount_ingredient_0 * ingredient_cost_0 + amount_ingredient_1 * ingredient_cost_1 + "
-            "amount_ingredient_2 * ingredient_cost_2 + amount_ingredient_3 * ingredient_cost_3 + "
-            "amount_ingredient_4 * ingredient_cost_4 + amount_ingredient_5 * ingredient_cost_5 + "
-            "amount_ingredient_6 * ingredient_cost_6 + amount_ingredient_7 * ingredient_cost_7 + "
-            "amount_ingredient_8 * ingredient_cost_8 + amount_ingredient_9 * ingredient_cost_9)")
+    @staticmethod
+    def static_db_upgrade(database):
+        """
+        Adds any tables/indexes introduced after the static database was created,
+        safe to run against an up-to-date database
+        Parameters:
+            database : SqlManager
+                Static database to upgrade
+        """
+        # one row per recipe ingredient, unpacked from the 10 wide column pairs of recipe
+        if not database.return_query(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'recipe_ingredient'"
+        ):
+            with database.transaction():
+                database.execute_query(
+                    "CREATE TABLE recipe_ingredient (recipe INTEGER NOT NULL, "
+                    "item INTEGER NOT NULL, amount INTEGER NOT NULL, "
+                    "FOREIGN KEY (recipe) REFERENCES recipe (csv_key))"
+                )
+                FfxivDbCreation.fill_recipe_ingredients(database)
+        database.execute_query(
+            "CREATE INDEX IF NOT EXISTS recipe_ingredient_recipe ON recipe_ingredient (recipe)"
+        )
+        database.execute_query(
+            "CREATE INDEX IF NOT EXISTS recipe_ingredient_item ON recipe_ingredient (item)"
+        )
+        database.execute_query(
+            "CREATE INDEX IF NOT EXISTS recipe_item_result ON recipe (item_result)"
+        )
+        # data_version is bumped by every refresh which changed the items or recipes
+        database.execute_query(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+        )
+        database.execute_query(
+            "INSERT OR IGNORE INTO meta (key, value) VALUES ('data_version', 0)"
+        )
+
+    @staticmethod
+    def fill_recipe_ingredients(database, recipes=None):
+        """
+        Unpacks the 10 wide ingredient column pairs of recipes into recipe_ingredient rows
+        Parameters:
+            database : SqlManager
+                Static database to fill
+            recipes : set
+                Recipe keys to replace the ingredients of, None to fill every recipe
+        """
+        select = " UNION ALL ".join(
+            f"SELECT csv_key, item_ingredient_{i}, amount_ingredient_{i} FROM recipe "
+            f"WHERE item_ingredient_{i} > 0 AND amount_ingredient_{i} > 0 {{condition}}"
+            for i in range(10)
+        )
+        if recipes is None:
+            database.execute_query(
+                "INSERT INTO recipe_ingredient (recipe, item, amount) "
+                + select.format(condition=""))
+            return
+        recipes = list(recipes)
+        with database.transaction():
+            # sized to stay under the SQLite bound variable limit
+            for i in range(0, len(recipes), 50):
+                batch = recipes[i:i + 50]
+                in_batch = f"({','.join('?' * len(batch))})"
+                database.execute_query(
+                    f"DELETE FROM recipe_ingredient WHERE recipe IN {in_batch}", batch)
+                database.execute_query(
+                    "INSERT INTO recipe_ingredient (recipe, item, amount) "
+                    + select.format(condition=f"AND csv_key IN {in_batch}"), batch * 10)
 
+    def market_db_create(self):
+        """
+        Creates the blank market data database, one row per item of the static database
+        """
+        self.database.execute_query(
+            'CREATE TABLE item (item_num INTEGER PRIMARY KEY, ave_cost INTEGER DEFAULT 0, '
+            'regular_sale_velocity REAL DEFAULT 0, ave_nq_cost INTEGER DEFAULT 0, '
+            'nq_sale_velocity REAL DEFAULT 0, ave_hq_cost INTEGER DEFAULT 0, '
+            'hq_sale_velocity REAL DEFAULT 0, gatherable TEXT DEFAULT "False" NOT NULL)'
+        )
         self.database.execute_query("ALTER TABLE item ADD cost_to_craft INTEGER DEFAULT 0;")
         self.database.execute_query(
             "ALTER TABLE item ADD craft_profit GENERATED ALWAYS AS "
@@ -155,193 +317,350 @@ class FfxivDbCreation:
             "(ave_cost * regular_sale_velocity);"
         )
 
+        self.market_db_upgrade(self.database)
+        print('item table created from static items')
+
+    @staticmethod
+    def market_db_upgrade(database):
+        """
+        Adds any tables/columns introduced after a market database was created and
+        syncs its items with the attached static database,
+        safe to run against an up-to-date database
+        Parameters:
+            database : SqlManager
+                Market database to upgrade, with the static database attached
+        """
+        item_columns = [column[1] for column in database.return_query("PRAGMA table_info(item)")]
+        if "last_sale_time" not in item_columns:
+            database.execute_query("ALTER TABLE item ADD last_sale_time INTEGER DEFAULT 0;")
+        if "last_refresh" not in item_columns:
+            database.execute_query("ALTER TABLE item ADD last_refresh INTEGER DEFAULT 0;")
+        if "last_upload_time" not in item_columns:
+            database.execute_query("ALTER TABLE item ADD last_upload_time INTEGER DEFAULT 0;")
+        if "history_depth" not in item_columns:
+            database.execute_query("ALTER TABLE item ADD history_depth INTEGER DEFAULT 0;")
+        if "craftable" not in item_columns:
+            database.execute_query("ALTER TABLE item ADD craftable INTEGER DEFAULT 0;")
+        if "effective_cost" not in item_columns:
+            database.execute_query("ALTER TABLE item ADD effective_cost INTEGER DEFAULT 0;")
+        if "craft_recipe" not in item_columns:
+            database.execute_query("ALTER TABLE item ADD craft_recipe INTEGER DEFAULT 0;")
+
+        database.execute_query(
+            "CREATE TABLE IF NOT EXISTS sale_history (item_num INTEGER NOT NULL, "
+            "timestamp INTEGER NOT NULL, price_per_unit INTEGER NOT NULL, "
+            "quantity INTEGER NOT NULL, hq INTEGER NOT NULL, world_id INTEGER DEFAULT 0, "
+            "UNIQUE (item_num, timestamp, price_per_unit, quantity, hq, world_id))"
+        )
+        database.execute_query(
+            "CREATE TABLE IF NOT EXISTS checkpoint (location TEXT PRIMARY KEY, "
+            "last_id INTEGER NOT NULL DEFAULT 0)"
+        )
+
+        # databases built before the static database kept their own copy of the recipes,
+        # drop it so the shared one is used
+        database.execute_query("DROP TABLE IF EXISTS main.recipe_ingredient")
+        database.execute_query("DROP TABLE IF EXISTS main.recipe")
+
+        # follow the items added to or removed from the static database and take its
+        # gatherable flags,
+        # the report filters are plain columns so the ranking indexes can be partial
+        database.execute_query(
+            "INSERT OR IGNORE INTO item (item_num, gatherable) "
+            "SELECT item_num, gatherable FROM static.item_info"
+        )
+        database.execute_query(
+            "DELETE FROM item WHERE item_num NOT IN (SELECT item_num FROM static.item_info)"
+        )
+        database.execute_query(
+            "UPDATE item SET gatherable = COALESCE((SELECT gatherable FROM static.item_info "
+            "WHERE item_info.item_num = item.item_num), gatherable), "
+            "craftable = item_num IN "
+            "(SELECT item_result FROM static.recipe WHERE recipe_level_table <= 1000)"
+        )
+        # each index stores its generated metric so a report page is a range scan
+        database.execute_query(
+            "CREATE INDEX IF NOT EXISTS item_craft_profit_per_day "
+            "ON item (craft_profit_per_day DESC) WHERE craftable = 1"
+        )
+        database.execute_query(
+            "CREATE INDEX IF NOT EXISTS item_raw_profit_per_day "
+            "ON item (raw_profit_per_day DESC) WHERE craftable = 1"
+        )
+        database.execute_query(
+            "CREATE INDEX IF NOT EXISTS item_gatherable_raw_profit_per_day "
+            "ON item (raw_profit_per_day DESC) WHERE gatherable = 'True'"
+        )
+
     def global_db_create(self):
         """
         Creates the blank global data database
         """
-        # gets a list of tuples containing the datacentre data
-        datacentres = self.get_data_from_url(
-            'https://raw.githubusercontent.com/xivapi/'
-            'ffxiv-datamining/master/csv/WorldDCGroupType.csv'
-        )
-        datacentres[1] = datacentres[1].replace('#', 'dc_key')
-        print('Got raw datacentre CSV')
+        self.prefetch([self.sources[source] for source in self.global_sources])
+        # streams the datacentre rows
+        datacentres = self.get_csv_rows(self.sources["datacentre"])
+        self.csv_to_db(self.filter_datacentres(datacentres), 'datacentre')
+        print('datacentre table created from usable datacentres')
 
-        # gets a list of tuples containing the world data
-        worlds = self.get_data_from_url(
-            'https://raw.githubusercontent.com/xivapi/ffxiv-datamining/master/csv/World.csv')
-        worlds[1] = worlds[1].replace('#', 'world_key')
-        print('got raw world CSV')
+        # streams the world rows
+        worlds = self.get_csv_rows(self.sources["world"])
+        self.csv_to_db(self.filter_worlds(worlds), 'world')
+        print('world table created from usable worlds')
 
-        usable_datacentres = self.filter_datacentres(datacentres)
-        print('datacentres CSV filtered to only usable')
+        self.csv_to_db(self.base_state_table(), 'state')
+        print('base state table created')
 
-        usable_worlds = self.filter_worlds(worlds)
-        print('worlds CSV filtered to only usable')
+    def global_db_refresh(self):
+        """
+        Updates the global data in place from the latest source files, the state
+        table is left as it is
+        """
+        self.prefetch([self.sources[source] for source in self.global_sources])
+        datacentres = self.get_csv_rows(self.sources["datacentre"])
+        self.stage_table(self.filter_datacentres(datacentres), 'datacentre')
+        changed, removed = self.merge_staged_table('datacentre', 'dc_key')
+        print(f'datacentre table refreshed, {len(changed)} datacentres added or changed, '
+              f'{len(removed)} removed')
+
+        worlds = self.get_csv_rows(self.sources["world"])
+        self.stage_table(self.filter_worlds(worlds), 'world')
+        changed, removed = self.merge_staged_table('world', 'world_key')
+        print(f'world table refreshed, {len(changed)} worlds added or changed, '
+              f'{len(removed)} removed')
 
-        state_table = self.base_state_table()
-        print('base state table data')
+    @staticmethod
+    def mirror_url(url):
+        """
+        Keeps a local copy of a source file, revalidated with a conditional GET so it
+        is only downloaded again once it changed. The local copy is used as it is
+        when the source can't be reached, so databases can be rebuilt offline.
+        Returns the path of the local copy.
+        Parameters:
+            url : str
+                url to perform the http request on
+        """
+        mirror_dir = FfxivDbCreation.mirror_dir
+        os.makedirs(mirror_dir, exist_ok=True)
+        index_path = os.path.join(mirror_dir, "index.json")
+        path = os.path.join(mirror_dir, url.rstrip('/').rsplit('/', 1)[-1])
+
+        headers = {}
+        with FfxivDbCreation._mirror_lock:
+            entry = FfxivDbCreation.read_mirror_index(index_path).get(url, {})
+        if os.path.exists(path):
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            request_data = HttpHandler.get(url, headers=headers, stream=True)
+        except requests.RequestException as err:
+            if os.path.exists(path):
+                print(f"{url} not reachable ({err}), using mirrored copy")
+                return path
+            sys.exit(f"{url} not available")
+
+        with request_data:
+            if request_data.status_code == 304:
+                return path
+            if request_data.status_code != 200:
+                if os.path.exists(path):
+                    print(f"{url} returned {request_data.status_code}, using mirrored copy")
+                    return path
+                sys.exit(f"{url} not available")
+            # written aside and swapped in, so an interrupted download keeps the old copy
+            with open(path + ".part", 'wb') as mirror_file:
+                for chunk in request_data.iter_content(65536):
+                    mirror_file.write(chunk)
+            os.replace(path + ".part", path)
+            entry = {
+                "etag": request_data.headers.get("ETag"),
+                "last_modified": request_data.headers.get("Last-Modified")
+            }
+        # other downloads may have updated the index meanwhile, so it is re-read
+        with FfxivDbCreation._mirror_lock:
+            index = FfxivDbCreation.read_mirror_index(index_path)
+            index[url] = entry
+            with open(index_path, 'w', encoding='utf-8') as index_file:
+                json.dump(index, index_file, indent=2)
+        return path
 
-        self.csv_to_db(usable_datacentres, 'datacentre')
-        print('datacentre table created')
+    @staticmethod
+    def read_mirror_index(index_path):
+        """
+        Reads the validators of every mirrored source file, empty before the first download
+        Parameters:
+            index_path : str
+                Path of the mirror index file
+        """
+        if not os.path.exists(index_path):
+            return {}
+        with open(index_path, encoding='utf-8') as index_file:
+            return json.load(index_file)
 
-        self.csv_to_db(usable_worlds, 'world')
-        print('world table created')
+    @staticmethod
+    def prefetch(urls):
+        """
+        Starts mirroring the source files in the background, each is then read as
+        soon as its own download finished instead of after the ones before it
+        Parameters:
+            urls : list
+                urls of the source files which will be read
+        """
+        executor = ThreadPoolExecutor(max_workers=len(urls))
+        with FfxivDbCreation._mirror_lock:
+            for url in urls:
+                FfxivDbCreation._downloads[url] = executor.submit(FfxivDbCreation.mirror_url, url)
+        executor.shutdown(wait=False)
 
-        self.csv_to_db(state_table, 'state')
+    @staticmethod
+    def mirror_path(url):
+        """
+        Returns the path of the local copy of a source file, waiting for its
+        prefetched download or mirroring it now if it wasn't prefetched
+        Parameters:
+            url : str
+                url of the source file
+        """
+        with FfxivDbCreation._mirror_lock:
+            download = FfxivDbCreation._downloads.pop(url, None)
+        if download is None:
+            return FfxivDbCreation.mirror_url(url)
+        return download.result()
 
     @staticmethod
     def get_data_from_url(url):
         """
-        pulls data from web apis
+        pulls data from web apis, through the local mirror
+        Parameters:
+            url : str
+                url to perform the http request on
+        """
+        with open(FfxivDbCreation.mirror_path(url), encoding='utf-8-sig') as data_file:
+            return data_file.read().splitlines()
+
+    @staticmethod
+    def get_csv_rows(url):
+        """
+        streams a CSV from web apis through the local mirror, yielding each parsed row
+        so quoted commas and line breaks are handled and the file is never held whole
         Parameters:
             url : str
                 url to perform the http request on
         """
-        request_data = requests.get(url)
-        if request_data.status_code == 200:
-            data = request_data.content.decode('utf-8-sig')
-            return data.splitlines()
-        sys.exit(f"{url} not available")
+        path = FfxivDbCreation.mirror_path(url)
+        with open(path, newline='', encoding='utf-8-sig') as csv_file:
+            yield from csv.reader(csv_file)
 
     def get_marketable_ids(self):
         """
         Retrieves data for marketable items
         """
-        marketable_id_data = self.get_data_from_url("https://universalis.app/api/marketable")
-        marketable_ids = marketable_id_data[0].split(',')
-        marketable_ids[0] = marketable_ids[0].replace('[', '')
-        marketable_ids[-1] = marketable_ids[-1].replace(']', '')
-        return marketable_ids
+        marketable_id_data = self.get_data_from_url(self.sources["marketable"])
+        return {str(item_id) for item_id in json.loads("".join(marketable_id_data))}
 
     @staticmethod
     def filter_marketable_recipes(recipes, marketable_ids):
         """
         Filters recipes to marketable items
         Parameters:
-            recipes : list
-                Raw recipe data from api
-            marketable_ids : list
-                List of marketable item IDs
-        """
-        marketable_recipes = recipes[0:3]
-        marketable_recipes[
-            1] = 'csv_key,number,craft_type,recipe_level_table,item_result,amount_result,' \
-                 'item_ingredient_0,amount_ingredient_0,item_ingredient_1,amount_ingredient_1,' \
-                 'item_ingredient_2,amount_ingredient_2,item_ingredient_3,amount_ingredient_3,' \
-                 'item_ingredient_4,amount_ingredient_4,item_ingredient_5,amount_ingredient_5,' \
-                 'item_ingredient_6,amount_ingredient_6,item_ingredient_7,amount_ingredient_7,' \
-                 'item_ingredient_8,amount_ingredient_8,item_ingredient_9,amount_ingredient_9'
-
-        marketable_recipes[
-            2] = 'INTEGER PRIMARY KEY,INTEGER,INTEGER,INTEGER,INTEGER,INTEGER,' \
-                 'INTEGER,INTEGER,INTEGER,INTEGER,' \
-                 'INTEGER,INTEGER,INTEGER,INTEGER,' \
-                 'INTEGER,INTEGER,INTEGER,INTEGER,' \
-                 'INTEGER,INTEGER,INTEGER,INTEGER,' \
-                 'INTEGER,INTEGER,INTEGER,INTEGER'
-
-        marketable_recipes[1] = tuple(marketable_recipes[1].split(','))
-        marketable_recipes[2] = tuple(marketable_recipes[2].split(','))
-
-        for line in recipes[3:]:
-            split_line = line.split(',')
-            crafted_item_id = split_line[4]
-            if crafted_item_id in marketable_ids:
-                marketable_recipes.append(tuple(split_line[:26]))
-        return marketable_recipes
+            recipes : iterator
+                Parsed rows of the raw recipe data from api, header rows first
+            marketable_ids : set
+                Marketable item IDs
+        """
+        for _ in range(3):
+            next(recipes)
+        column_names = tuple(
+            'csv_key,number,craft_type,recipe_level_table,item_result,amount_result,'
+            'item_ingredient_0,amount_ingredient_0,item_ingredient_1,amount_ingredient_1,'
+            'item_ingredient_2,amount_ingredient_2,item_ingredient_3,amount_ingredient_3,'
+            'item_ingredient_4,amount_ingredient_4,item_ingredient_5,amount_ingredient_5,'
+            'item_ingredient_6,amount_ingredient_6,item_ingredient_7,amount_ingredient_7,'
+            'item_ingredient_8,amount_ingredient_8,item_ingredient_9,amount_ingredient_9'.split(',')
+        )
+        data_types = ('INTEGER PRIMARY KEY',) + ('INTEGER',) * 25
+
+        marketable_recipes = (
+            tuple(row[:26]) for row in recipes if len(row) > 4 and row[4] in marketable_ids
+        )
+        return column_names, data_types, marketable_recipes
 
     @staticmethod
     def filter_datacentres(datacentres):
         """
         Filters for usable datacentres
         Parameters:
-            datacentres : list
-                Raw datacentre data from api
-        """
-        usable_datacentres = datacentres[0:3]
-        usable_datacentres[1] = 'dc_key,name,region'
-        usable_datacentres[2] = 'INTEGER PRIMARY KEY, STRING, INTEGER'
-        usable_datacentres[1] = tuple(usable_datacentres[1].split(','))
-        usable_datacentres[2] = tuple(usable_datacentres[2].split(','))
-
-        for line in datacentres[3:]:
-            split_line = line.split(',')
-            datacentre_id = int(split_line[0])
-            unquoted_line = []
-            for item in split_line:
-                unquoted_line.append(item.replace('"', ''))
-            if 1 <= datacentre_id < 99:
-                usable_datacentres.append(tuple(unquoted_line))
-        return usable_datacentres
+            datacentres : iterator
+                Parsed rows of the raw datacentre data from api, header rows first
+        """
+        for _ in range(3):
+            next(datacentres)
+        column_names = ('dc_key', 'name', 'region')
+        data_types = ('INTEGER PRIMARY KEY', 'STRING', 'INTEGER')
+        usable_datacentres = (
+            tuple(row[:3]) for row in datacentres if row and 1 <= int(row[0]) < 99
+        )
+        return column_names, data_types, usable_datacentres
 
     @staticmethod
     def filter_worlds(worlds):
         """
         Filters for usable worlds
         Parameters:
-            worlds : list
-                Raw world data from api
-        """
-        usable_worlds = worlds[0:3]
-        usable_worlds[1] = 'world_key, name, datacenter'
-        usable_worlds[2] = 'INTEGER PRIMARY KEY, STRING, INTEGER'
-        usable_worlds[1] = tuple(usable_worlds[1].split(','))
-        usable_worlds[2] = tuple(usable_worlds[2].split(','))
-
-        for line in worlds[3:]:
-            split_line = line.split(',')
-            world_id = int(split_line[0])
-            is_public = split_line[-1]
-            if is_public == 'True' and world_id != 38:
-                split_line = [split_line[0], split_line[2].replace('"', ''), split_line[5]]
-                usable_worlds.append(tuple(split_line))
-        return usable_worlds
+            worlds : iterator
+                Parsed rows of the raw world data from api, header rows first
+        """
+        for _ in range(3):
+            next(worlds)
+        column_names = ('world_key', 'name', 'datacenter')
+        data_types = ('INTEGER PRIMARY KEY', 'STRING', 'INTEGER')
+        usable_worlds = (
+            tuple((row[0], row[2], row[5])) for row in worlds
+            if row and row[-1] == 'True' and int(row[0]) != 38
+        )
+        return column_names, data_types, usable_worlds
 
     @staticmethod
     def base_state_table():
         """
         Creates the base templated state table
         """
-        state = ['key,0,1',
-                 'marketboard_type,location,last_id',
-                 'STRING,STRING NOT NULL UNIQUE,INTEGER',
-                 'World,Zurvan,0']
-        state[0] = tuple(state[0].split(","))
-        state[1] = tuple(state[1].split(','))
-        state[2] = tuple(state[2].split(','))
-        state[3] = tuple(state[3].split(','))
-        return state
-
-    def add_gatherable(self):
-        """
-        Marks gatherable items in item table
-        """
-        gatherable_id_data = self.get_data_from_url("https://raw.githubusercontent.com"
-                                                    "/xivapi/ffxiv-datamining/master/csv/"
-                                                    "GatheringItem.csv")
-        gatherable_items = []
-        for item in gatherable_id_data[3:]:
-            item_data = item.split(",")
-            if item_data[3] == "True":
-                gatherable_items.append(tuple((item_data[1],)))
+        column_names = ('marketboard_type', 'location', 'last_id')
+        data_types = ('STRING', 'STRING NOT NULL UNIQUE', 'INTEGER')
+        return column_names, data_types, [('World', 'Zurvan', 0)]
+
+    def add_gatherable(self, table_name='item_info'):
+        """
+        Marks gatherable items in item_info table
+        Parameters:
+            table_name : string
+                Name of the item table to mark, the staged copy during a refresh
+        """
+        gatherable_id_data = self.get_csv_rows(self.sources["gathering"])
+        for _ in range(3):
+            next(gatherable_id_data)
+        gatherable_items = (
+            tuple((item_data[1],)) for item_data in gatherable_id_data
+            if len(item_data) > 3 and item_data[3] == "True"
+        )
         self.database.execute_query_many(
-            "UPDATE item SET gatherable = 'True' WHERE item_num = ?", gatherable_items)
+            f"UPDATE {table_name} SET gatherable = 'True' WHERE item_num = ?", gatherable_items)
 
     # function used to convert original files into the DB
     def csv_to_db(self, csv_data, table_name):
         """
-        Filters for usable worlds
+        Creates a table and streams its rows in through one prepared statement
         Parameters:
-            csv_data : list
-                Schema/data for db creation/population
+            csv_data : tuple
+                Column names, data types and an iterable of rows for db creation/population
             table_name : string
                 Name of the table to be created in the database
         """
         database = self.database
 
-        column_names = csv_data[1]
-        data_types = csv_data[2]
+        column_names = list(csv_data[0])
+        data_types = csv_data[1]
         num_columns = len(column_names)
 
         question_marks = ""
@@ -359,11 +678,59 @@ class FfxivDbCreation:
             creation_command = creation_command + f"{column_names[i]} {data_types[i]}, "
         if table_name == "recipe":
             creation_command = creation_command + \
-                               "FOREIGN KEY (item_result) REFERENCES item (item_num))"
+                               "FOREIGN KEY (item_result) REFERENCES item_info (item_num))"
         else:
             creation_command = creation_command[:-2] + ")"
         database.execute_query(creation_command)
 
         # insert all values
         insert_command = f"INSERT INTO {table_name} VALUES ({question_marks})"
-        database.execute_query_many(insert_command, csv_data[3:])
+        database.execute_query_many(insert_command, csv_data[2])
+
+    def stage_table(self, csv_data, table_name):
+        """
+        Loads the latest rows of a table into an empty temporary copy of it,
+        staged_{table_name}, to be merged into the table
+        Parameters:
+            csv_data : tuple
+                Column names, data types and an iterable of rows, as for csv_to_db
+            table_name : string
+                Name of the table the rows are for
+        """
+        self.database.execute_query(f"DROP TABLE IF EXISTS temp.staged_{table_name}")
+        self.database.execute_query(
+            f"CREATE TEMP TABLE staged_{table_name} AS SELECT * FROM main.{table_name} WHERE 0"
+        )
+        question_marks = ",".join("?" * len(csv_data[0]))
+        self.database.execute_query_many(
+            f"INSERT INTO temp.staged_{table_name} VALUES ({question_marks})", csv_data[2]
+        )
+
+    def merge_staged_table(self, table_name, key):
+        """
+        Applies only the rows of the staged copy which were inserted or changed, and
+        deletes the rows missing from it, returning the sets of changed and removed keys
+        Parameters:
+            table_name : string
+                Name of the table to merge the staged copy into
+            key : string
+                Primary key column of the table
+        """
+        database = self.database
+        changed = {row[0] for row in database.return_query(
+            f"SELECT {key} FROM (SELECT * FROM temp.staged_{table_name} "
+            f"EXCEPT SELECT * FROM main.{table_name})"
+        )}
+        removed = {row[0] for row in database.return_query(
+            f"SELECT {key} FROM main.{table_name} "
+            f"EXCEPT SELECT {key} FROM temp.staged_{table_name}"
+        )}
+        database.execute_query(
+            f"INSERT OR REPLACE INTO main.{table_name} "
+            f"SELECT * FROM temp.staged_{table_name} EXCEPT SELECT * FROM main.{table_name}"
+        )
+        database.execute_query_many(
+            f"DELETE FROM main.{table_name} WHERE {key} = ?", [(row,) for row in removed]
+        )
+        database.execute_query(f"DROP TABLE temp.staged_{table_name}")
+        return changed, removed
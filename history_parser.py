@@ -0,0 +1,217 @@
+"""
+Module for incrementally parsing Universalis history responses for FFXIV-Market-Calculator
+"""
+import codecs
+import json
+import re
+
+
+class HistoryParser:
+    """
+    Class for streaming a Universalis history body without decoding it whole.
+
+    Sale entries arrive newest first, so each entries array is decoded only until
+    the first sale at or before the item's cutoff, the rest of the array is skipped
+    without building any objects. Kept sales are reduced to compact
+    (timestamp, pricePerUnit, quantity, hq, worldID) tuples, every other field is
+    decoded as normal. Both single and multi-item ("items") bodies are supported.
+
+    Attributes:
+    -------
+    chunks : iterator
+        Byte chunks of the response body
+    cutoffs : dict
+        Item number to the timestamp at or before which sales are not kept
+    default_item : int
+        Item number a single-item body belongs to
+
+    Methods:
+    -------
+    parse():
+        Parses the whole body and returns the decoded history
+    """
+    _WHITESPACE = re.compile(r'[ \t\n\r]*')
+    _SKIP_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*(")?|[\[\]{}]')
+    _NUMBER_TAIL = re.compile(r'[0-9.eE+-]*')
+
+    def __init__(self, chunks, cutoffs=None, default_item=None):
+        """
+        Constructs all the necessary attributes for the HistoryParser object.
+
+        Parameters:
+            chunks : iterable[bytes]
+                Byte chunks of the response body
+            cutoffs : dict
+                Item number to the timestamp at or before which sales are not kept
+            default_item : int
+                Item number a single-item body belongs to
+        """
+        self.chunks = iter(chunks)
+        self.cutoffs = cutoffs or {}
+        self.default_item = default_item
+        self._utf8 = codecs.getincrementaldecoder('utf-8-sig')()
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def parse(self):
+        """
+        Parses the whole body and returns the decoded history. Each history gets an
+        "entries" list of kept sale tuples, "reachedCutoff" when its entries went
+        back past the cutoff, "entryCount" of entries read and "droppedEntries" of
+        malformed entries which were ignored.
+        """
+        self._expect('{')
+        history = self._history(self.default_item, top_level=True)
+        if self._peek() is not None:
+            raise ValueError(f"Extra data after history at char {self._pos}")
+        return history
+
+    def _fill(self):
+        """
+        Reads the next chunk into the buffer, returns False at the end of the body
+        """
+        if self._eof:
+            return False
+        self._buffer = self._buffer[self._pos:]
+        self._pos = 0
+        for chunk in self.chunks:
+            if chunk:
+                self._buffer += self._utf8.decode(chunk)
+                return True
+        self._buffer += self._utf8.decode(b'', final=True)
+        self._eof = True
+        return False
+
+    def _peek(self):
+        """
+        Skips whitespace and returns the next character, None at the end of the body
+        """
+        while True:
+            self._pos = self._WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return None
+
+    def _expect(self, character):
+        """
+        Consumes the next character, which must be the given one
+        """
+        found = self._peek()
+        if found != character:
+            raise ValueError(f"Expected {character!r} but found {found!r} at char {self._pos}")
+        self._pos += 1
+
+    def _value(self):
+        """
+        Decodes the next complete JSON value
+        """
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                number = isinstance(value, (int, float)) and not isinstance(value, bool)
+                # a number running up to the end of the buffer may continue in the next chunk
+                if self._eof or not number or \
+                        self._NUMBER_TAIL.match(self._buffer, end).end() < len(self._buffer):
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill()
+
+    def _keys(self):
+        """
+        Yields the keys of the object whose '{' was just consumed, the caller must
+        consume each value before asking for the next key
+        """
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            yield key
+            if self._peek() == ',':
+                self._pos += 1
+            else:
+                self._expect('}')
+                return
+
+    def _history(self, item_number, top_level=False):
+        """
+        Parses a history object whose '{' was just consumed
+        """
+        history = {}
+        for key in self._keys():
+            if key == "entries":
+                self._entries(history, self.cutoffs.get(item_number, 0))
+            elif key == "items" and top_level and self._peek() == '{':
+                self._pos += 1
+                history["items"] = {}
+                for item_key in self._keys():
+                    self._expect('{')
+                    history["items"][item_key] = self._history(int(item_key))
+            else:
+                history[key] = self._value()
+        return history
+
+    def _entries(self, history, cutoff):
+        """
+        Parses an entries array, keeping the sales newer than the cutoff
+        """
+        history.update({"entries": [], "reachedCutoff": False,
+                        "entryCount": 0, "droppedEntries": 0})
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            entry = self._value()
+            history["entryCount"] += 1
+            try:
+                sale = (entry["timestamp"], entry["pricePerUnit"], entry["quantity"],
+                        bool(entry["hq"]), entry.get("worldID", 0))
+                expired = sale[0] <= cutoff
+            except (KeyError, TypeError):
+                history["droppedEntries"] += 1
+            else:
+                if expired:
+                    history["reachedCutoff"] = True
+                    self._skip_array()
+                    return
+                history["entries"].append(sale)
+            if self._peek() == ',':
+                self._pos += 1
+            else:
+                self._expect(']')
+                return
+
+    def _skip_array(self):
+        """
+        Skips the rest of the array being parsed, including its closing ']',
+        matching brackets outside of strings without decoding anything
+        """
+        depth = 1
+        while True:
+            for token in self._SKIP_TOKEN.finditer(self._buffer, self._pos):
+                text = token.group()
+                if text[0] == '"':
+                    if token.group(1) is None:
+                        # string continues in the next chunk, rescan it from its start
+                        self._pos = token.start()
+                        break
+                elif text in '[{':
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        self._pos = token.end()
+                        return
+            else:
+                self._pos = len(self._buffer)
+            if not self._fill():
+                raise ValueError("Body ended inside an entries array")
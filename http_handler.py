@@ -0,0 +1,146 @@
+"""
+Module for handling the shared http sessions for FFXIV-Market-Calculator
+"""
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry, make_headers
+
+
+class HttpHandler:
+    """
+    Class for handling the script http calls through pooled keep-alive sessions.
+
+    Attributes:
+    -------
+    _SESSIONS : dict
+        Holds one Session object per host and 429 retry choice
+    _LOCK : Lock object
+        Guards session creation across threads
+    timeout : tuple
+        Default (connect, read) timeout in seconds
+    pool_size : int
+        Maximum kept-alive connections per host
+
+    Methods:
+    -------
+    __create_session(retry_rate_limits):
+        Creates a new session with pooling, compression and retries
+    get_session(url, retry_rate_limits):
+        Retrieves the shared session for the host of the url
+    request(method, url, retry_rate_limits, **kwargs):
+        Performs a http request through the shared session
+    get(url, **kwargs):
+        Performs a GET request
+    post(url, data, **kwargs):
+        Performs a POST request
+    patch(url, data, **kwargs):
+        Performs a PATCH request
+    """
+    _SESSIONS = {}
+    _LOCK = threading.Lock()
+    timeout = (5, 30)
+    pool_size = 32
+
+    @staticmethod
+    def __create_session(retry_rate_limits=True):
+        """
+        A private method that builds a session which keeps connections alive,
+        accepts gzip/brotli bodies and retries failed calls with backoff
+
+        Parameters:
+            retry_rate_limits : bool
+                Whether rate limited (429) calls are retried too
+        """
+        status_forcelist = (500, 502, 503, 504)
+        if retry_rate_limits:
+            status_forcelist = (429,) + status_forcelist
+        retries = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=status_forcelist,
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS | {"PATCH"},
+            # a Retry-After header makes urllib3 retry a 429 even outside status_forcelist
+            respect_retry_after_header=retry_rate_limits,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HttpHandler.pool_size,
+                              max_retries=retries)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update(make_headers(keep_alive=True, accept_encoding=True))
+        return session
+
+    @staticmethod
+    def get_session(url, retry_rate_limits=True):
+        """
+        A static method that returns the shared session for the host of the url
+
+        Parameters:
+            url : str
+                url the session will be used for
+            retry_rate_limits : bool
+                Whether rate limited (429) calls are retried by the session
+        """
+        key = tuple((urlsplit(url).netloc, retry_rate_limits))
+        with HttpHandler._LOCK:
+            if key not in HttpHandler._SESSIONS:
+                HttpHandler._SESSIONS[key] = HttpHandler.__create_session(retry_rate_limits)
+            return HttpHandler._SESSIONS[key]
+
+    @staticmethod
+    def request(method, url, retry_rate_limits=True, **kwargs):
+        """
+        Performs a http request through the shared session, applying the default timeout
+
+        Parameters:
+            method : str
+                Http method to use
+            url : str
+                url to perform the http request on
+            retry_rate_limits : bool
+                False to get 429 responses back straight away, for callers
+                following the rate limit themselves
+        """
+        kwargs.setdefault("timeout", HttpHandler.timeout)
+        return HttpHandler.get_session(url, retry_rate_limits).request(method, url, **kwargs)
+
+    @staticmethod
+    def get(url, **kwargs):
+        """
+        Performs a GET request
+
+        Parameters:
+            url : str
+                url to perform the http request on
+        """
+        return HttpHandler.request("GET", url, **kwargs)
+
+    @staticmethod
+    def post(url, data=None, **kwargs):
+        """
+        Performs a POST request
+
+        Parameters:
+            url : str
+                url to perform the http request on
+            data : str
+                Request body
+        """
+        return HttpHandler.request("POST", url, data=data, **kwargs)
+
+    @staticmethod
+    def patch(url, data=None, **kwargs):
+        """
+        Performs a PATCH request
+
+        Parameters:
+            url : str
+                url to perform the http request on
+            data : str
+                Request body
+        """
+        return HttpHandler.request("PATCH", url, data=data, **kwargs)
@@ -1,46 +1,74 @@
 """Main module for FFXIV-Market-Calculator"""
-import json
-import math
+import argparse
+import functools
 import os
-import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
+import numpy as np
 
 from message_builder import MessageBuilder
 from config_handler import ConfigHandler
+from craft_resolver import CraftResolver
 from discord_handler import DiscordHandler
+from export_handler import ExportHandler
 from ffxiv_db_constructor import FfxivDbCreation as Db_Create
 from log_handler import LogHandler
+from refresh_scheduler import RefreshScheduler
 from sql_helpers import SqlManager
+from universalis_handler import UniversalisHandler
+
+
+def create_database(db_name, label):
+    """
+    Creates a database if it doesn't exist yet, returning whether it was created
+
+    Parameters:
+        db_name : str
+            Database path/filename
+        label : str
+            Name of the database for the console messages
+    """
+    try:
+        Db_Create(db_name)
+    except ValueError:
+        print(f"{label} Database already exists")
+        return False
+    print(f"New {label} DB Created")
+    return True
+
 
 global_db_path = os.path.join("databases", "global_db")
-try:
-    Db_Create(global_db_path)
-    print("New Global DB Created")
-except ValueError:
-    print("Global Database already exists")
+# the global and static databases are built from different sources, so side by side
+with ThreadPoolExecutor(max_workers=2) as bootstrap:
+    global_created = bootstrap.submit(create_database, global_db_path, "Global")
+    static_created = bootstrap.submit(create_database, Db_Create.static_db, "Static")
+global_created.result()
+if not static_created.result():
+    Db_Create.static_db_upgrade(SqlManager(Db_Create.static_db))
 global_db = SqlManager(global_db_path)
 config = ConfigHandler('config.ini', global_db)
 logging_config = config.parse_logging_config()
 message_builder = MessageBuilder(logging_config)
+craft_resolver = CraftResolver(logging_config)
 FFXIV_LOGGER = LogHandler.get_logger(__name__, logging_config)
 
 
-def api_delay():
-    """Handles Sleep for synchronous api calls"""
-    time.sleep(0.07)  # API only allows 20 checks/sec.
-
-
-def get_sale_nums(item_number, location):
+def get_sale_nums(item_number, data, request_response):
     """
-    Gets the velocity and sale data and creates a dict with it.
+    Takes the fetched velocity and new sale data and creates a dict with the results
+    along with the new sales rows. The sales are folded into the stored history and
+    the averages filled in from it when the item is checkpointed. The last value is
+    1 on success, 0 when there was no data and -1 when the history could not be read.
 
     Parameters:
-        item_number : str
-            The config file path/name
-        location : str
-            Global database to store shared values
+        item_number : int
+            Item number the sales data belongs to
+        data : dict
+            Streamed Universalis history, entries as
+            (timestamp, pricePerUnit, quantity, hq, worldID) tuples
+        request_response : Response
+            Http response the data was decoded from
     """
     sales_dict = {
         "regular_sale_velocity": 0,
@@ -48,219 +76,303 @@ def get_sale_nums(item_number, location):
         "hq_sale_velocity": 0,
         "ave_nq_cost": 0,
         "ave_hq_cost": 0,
-        "ave_cost": 0
+        "ave_cost": 0,
+        "last_sale_time": 0,
+        "last_upload_time": 0,
+        "history_depth": 0
     }
 
-    data, request_response = get_sale_data(item_number, location)
-    if request_response.status_code == 404 or not data:
-        try:
-            FFXIV_LOGGER.info(f"item_number {*item_number,} found no data")
-        except TypeError:
-            FFXIV_LOGGER.error(f"item_number {item_number} found no data")
-        except Exception as err:
-            FFXIV_LOGGER.error(f"{err} w/ data pull")
-        return sales_dict, 0
+    if not data or request_response.status_code == 404:
+        FFXIV_LOGGER.info(f"item_number {item_number} found no data")
+        return sales_dict, [], 0
 
     try:
-        if data["regularSaleVelocity"] > 142 or math.ceil(data["regularSaleVelocity"]) == 0:
-            data, request_response = get_sale_data(item_number, location, 10000)
         FFXIV_LOGGER.debug(data)
         sales_dict["regular_sale_velocity"] = round(data["regularSaleVelocity"], 1)
         sales_dict["nq_sale_velocity"] = round(data["nqSaleVelocity"], 1)
         sales_dict["hq_sale_velocity"] = round(data["hqSaleVelocity"], 1)
-        if len(data["entries"]) == 0 and math.ceil(sales_dict["regular_sale_velocity"]) == 0:
-            return sales_dict, 1
+        sales_dict["last_upload_time"] = data.get("lastUploadTime", 0)
+        new_sales = [tuple((item_number, *sale)) for sale in data["entries"]]
+        if data.get("droppedEntries"):
+            FFXIV_LOGGER.warning(
+                f"{data['droppedEntries']} malformed entries ignored w/ item_number {item_number}"
+            )
     except Exception as err:
         FFXIV_LOGGER.debug(data)
         FFXIV_LOGGER.error(f"{err} w/ item_number {item_number}")
-        return sales_dict, 0
+        return sales_dict, [], -1
 
-    sales = data["entries"]
     FFXIV_LOGGER.debug(sales_dict)
-    sales_dict = sales_calculations(sales_dict, sales)
-    return sales_dict, 1
+    return sales_dict, new_sales, 1
 
 
-def sales_calculations(sales_dict, sales):
+def store_sale_history(location_db, item_number, new_sales):
     """
-    Performing calculations against the raw sales data.
+    Folds newly fetched sales into the stored history and drops the sales
+    which have aged out of the 28-day window.
 
     Parameters:
-        sales_dict : dict
-            Stores post-calculated sales data
-        sales : dict
-            Raw sales data from api
-    """
-    total_nq_cost = 0
-    total_nq_sales = 0
-    total_hq_cost = 0
-    total_hq_sales = 0
-
-    # calculate the sales for nq and hq
-    cutoff = time.time() - 86400 * 28
-    for sale in sales:
-        if sale["timestamp"] > cutoff:  # only look at data that is < 4 weeks old
-            try:
-                if sale["pricePerUnit"] < 1000000:
-                    if not sale["hq"]:
-                        total_nq_cost += sale["pricePerUnit"] * sale["quantity"]
-                        total_nq_sales += sale["quantity"]
-                    else:
-                        total_hq_cost += sale["pricePerUnit"] * sale["quantity"]
-                        total_hq_sales += sale["quantity"]
-            except Exception as err:
-                FFXIV_LOGGER.warning(err)
-                return sales_dict
-        else:
-            break
+        location_db : SqlManager
+            Database object for performing SQL queries
+        item_number : int
+            Item number the sales belong to
+        new_sales : list[tuple]
+            (item_num, timestamp, price_per_unit, quantity, hq, world_id) rows
+    """
+    with location_db.transaction():
+        if new_sales:
+            location_db.execute_query_many(
+                "INSERT OR IGNORE INTO sale_history (item_num, timestamp, price_per_unit, "
+                "quantity, hq, world_id) VALUES (?, ?, ?, ?, ?, ?)", new_sales
+            )
+        location_db.execute_query(
+            "DELETE FROM sale_history WHERE item_num = ? AND timestamp <= ?",
+            [item_number, int(time.time() - 86400 * 28)]
+        )
 
-    # get averages and avoid divide by zero
-    try:
-        sales_dict["ave_nq_cost"] = int(total_nq_cost / total_nq_sales)
-    except ZeroDivisionError:
-        sales_dict["ave_nq_cost"] = 0
 
-    try:
-        sales_dict["ave_hq_cost"] = int(total_hq_cost / total_hq_sales)
-    except ZeroDivisionError:
-        sales_dict["ave_hq_cost"] = 0
+def get_sale_history(location_db, item_numbers):
+    """
+    Retrieves the stored 28-day window of sales for many items as one array of
+    (item_num, timestamp, price_per_unit, quantity, hq) rows ordered by item_num.
 
-    try:
-        sales_dict["ave_cost"] = int(
-            (total_nq_cost + total_hq_cost) / (total_nq_sales + total_hq_sales)
-        )
-    except ZeroDivisionError:
-        sales_dict["ave_cost"] = 0
+    Parameters:
+        location_db : SqlManager
+            Database object for performing SQL queries
+        item_numbers : list[int]
+            Item numbers to retrieve the sales for
+    """
+    rows = location_db.return_query(
+        f"SELECT item_num, timestamp, price_per_unit, quantity, hq FROM sale_history "
+        f"WHERE item_num IN ({','.join('?' * len(item_numbers))}) AND timestamp > ? "
+        f"ORDER BY item_num, timestamp DESC",
+        [*item_numbers, int(time.time() - 86400 * 28)]
+    )
+    return np.array(rows or [], dtype=np.int64).reshape(-1, 5)
 
-    return sales_dict
 
+def get_high_water(location_db, item_numbers):
+    """
+    Retrieves for many items the time up to which their stored history is complete:
+    the oldest of the newest stored sale of each world. Each world of a Datacentre
+    uploads its sales on its own, so a world can still add sales older than the
+    newest sale stored from another. Items without stored sales are left out.
 
-def get_sale_data(item_number, location, entries=5000):
+    Parameters:
+        location_db : SqlManager
+            Database object for performing SQL queries
+        item_numbers : list[int]
+            Item numbers to retrieve the high water marks for
     """
-    Calls the Universalis API and returns the data and the status code.
+    high_water = {}
+    # sized to stay under the SQLite bound variable limit
+    for i in range(0, len(item_numbers), 500):
+        batch = item_numbers[i:i + 500]
+        high_water.update(location_db.return_query(
+            f"SELECT item_num, MIN(newest) FROM (SELECT item_num, MAX(timestamp) AS newest "
+            f"FROM sale_history WHERE item_num IN ({','.join('?' * len(batch))}) "
+            f"GROUP BY item_num, world_id) GROUP BY item_num", batch
+        ) or [])
+    return high_water
+
+
+def sales_calculations(sales_dicts, sales):
+    """
+    Performing calculations against the raw sales data of many items in one pass.
 
     Parameters:
-        item_number : str
-            Item number to pull sales data for
-        location : str
-            World/DC Location to pull
-        entries : int
-            How many Universalis market sale entries to retrieve
+        sales_dicts : dict
+            Item number to the dict storing its post-calculated sales data
+        sales : numpy.ndarray
+            (item_num, timestamp, price_per_unit, quantity, hq) rows ordered by item_num
     """
-    request_response = requests.get(
-        f'https://universalis.app/api/v2/history/{location}/{item_number}'
-        f'?entriesToReturn={entries}'
+    if len(sales) == 0:
+        return sales_dicts
+    item_nums, timestamps, prices, quantities, hq = sales.T
+
+    # only look at data that is < 4 weeks old and skip outlier prices
+    in_window = timestamps > time.time() - 86400 * 28
+    counted = in_window & (prices < 1000000)
+    nq_sales = np.where(counted & (hq == 0), quantities, 0)
+    hq_sales = np.where(counted & (hq != 0), quantities, 0)
+
+    # rows are grouped by item so every total is one segmented reduction
+    starts = np.flatnonzero(np.diff(item_nums, prepend=item_nums[0] - 1))
+    totals = np.add.reduceat(
+        np.stack((nq_sales * prices, nq_sales, hq_sales * prices, hq_sales,
+                  in_window.astype(np.int64))), starts, axis=1
     )
-    try:
-        data = json.loads(request_response.content.decode('utf-8'))
-        return data, request_response
-    except Exception as err:
-        FFXIV_LOGGER.error(err)
-        return None, request_response
+    last_sales = np.maximum.reduceat(np.where(in_window, timestamps, 0), starts)
+
+    for item_number, total, last_sale in zip(item_nums[starts].tolist(), totals.T.tolist(),
+                                             last_sales.tolist()):
+        total_nq_cost, total_nq_sales, total_hq_cost, total_hq_sales, depth = total
+        sales_dict = sales_dicts[item_number]
+        # get averages and avoid divide by zero
+        sales_dict["ave_nq_cost"] = int(total_nq_cost / total_nq_sales) if total_nq_sales else 0
+        sales_dict["ave_hq_cost"] = int(total_hq_cost / total_hq_sales) if total_hq_sales else 0
+        if total_nq_sales + total_hq_sales:
+            sales_dict["ave_cost"] = int(
+                (total_nq_cost + total_hq_cost) / (total_nq_sales + total_hq_sales)
+            )
+        else:
+            sales_dict["ave_cost"] = 0
+        sales_dict["last_sale_time"] = last_sale
+        sales_dict["history_depth"] = depth
+    return sales_dicts
 
 
-def update_from_api(location_db, location, start_id, update_quantity):
+def write_checkpoint(location_db, location, pending, cursor):
     """
-    Main bridge between pulling the sales data and storing it in the database.
+    Makes the items fetched since the last checkpoint durable in one transaction:
+    folds their new sales into the stored history, writes their reduced sales data
+    and refresh times and moves the sequential cursor past them. The cursor lives in
+    the location database so it can never run ahead of the prices, the global state
+    is only a mirror of it.
 
     Parameters:
         location_db : SqlManager
             Database object for performing SQL queries
         location : str
-            World/DC Location to pull
-        start_id : str
-            Which item ID to start the sequential update from
-        update_quantity : int
-            How many items to refresh from the API
+            World/DC Location being updated
+        pending : dict
+            Item number to (sales_dict, new_sales, refresh_time), sales_dict is None
+            for items which found no data and refresh_time for failed requests and
+            unreadable histories
+        cursor : int
+            Last item of the sequential walk with every item up to it durable,
+            0 once the walk is complete and None to leave the cursor unchanged
     """
-    last_id = location_db.return_query('SELECT item_num FROM item ORDER BY item_num DESC LIMIT 1')
-    last_item = int(last_id[0][0])
-    if update_quantity == 0:
-        query = f"SELECT item_num FROM item WHERE item_num >= {start_id}"
-    else:
-        query = f"SELECT item_num FROM item WHERE item_num >= {start_id} " \
-                f"ORDER BY item_num ASC LIMIT {update_quantity}"
-    data = location_db.return_query(query)
-
+    fetched = [item_number for item_number, (sales_dict, _, _) in pending.items()
+               if sales_dict is not None]
     update_list = []
-    for item_number in data:
-        api_delay_thread = threading.Thread(target=api_delay)
-        api_delay_thread.start()
-        dictionary, success = get_sale_nums(*item_number, location)
-        if success == 1:
-            dictionary['item_num'] = item_number[0]
+    with location_db.transaction():
+        for item_number in fetched:
+            store_sale_history(location_db, item_number, pending[item_number][1])
+        # reduce the stored windows of many items in a single pass, sized to stay
+        # under the SQLite bound variable limit
+        for i in range(0, len(fetched), 500):
+            batch = fetched[i:i + 500]
+            sales_calculations({item_number: pending[item_number][0] for item_number in batch},
+                               get_sale_history(location_db, batch))
+        for item_number in fetched:
+            dictionary = pending[item_number][0]
+            dictionary['item_num'] = item_number
             update_list.append(tuple((dictionary.values())))
-            FFXIV_LOGGER.info(f"item_number {*item_number,} queued for update")
-            if item_number[0] == last_item:
-                global_db.execute_query(
-                    f'UPDATE state SET last_id = 0 WHERE location LIKE "{location}"'
-                )
-            else:
-                global_db.execute_query(
-                    f'UPDATE state SET last_id = %i WHERE location LIKE "{location}"' % item_number
-                )
-        api_delay_thread.join()
-    FFXIV_LOGGER.debug(update_list)
-    location_db.execute_query_many("UPDATE item SET regular_sale_velocity = ?, "
-                                   "nq_sale_velocity = ?, hq_sale_velocity = ?, ave_nq_cost = ?, "
-                                   "ave_hq_cost = ?, ave_cost = ? "
-                                   "WHERE item_num = ?", update_list)
-
-
-def update_ingredient_costs(location_db):
-    """
-    Takes the sales data and updates any crafting ingredient costs.
+            FFXIV_LOGGER.info(f"item_number {item_number} queued for update")
+        FFXIV_LOGGER.debug(update_list)
+        location_db.execute_query_many("UPDATE item SET regular_sale_velocity = ?, "
+                                       "nq_sale_velocity = ?, hq_sale_velocity = ?, "
+                                       "ave_nq_cost = ?, ave_hq_cost = ?, ave_cost = ?, "
+                                       "last_sale_time = ?, last_upload_time = ?, "
+                                       "history_depth = ? WHERE item_num = ?", update_list)
+        location_db.execute_query_many(
+            "UPDATE item SET last_refresh = ? WHERE item_num = ?",
+            [tuple((refresh_time, item_number))
+             for item_number, (_, _, refresh_time) in pending.items() if refresh_time]
+        )
+        if cursor is not None:
+            location_db.execute_query(
+                "INSERT OR REPLACE INTO checkpoint (location, last_id) VALUES (?, ?)",
+                [location, cursor]
+            )
+    if cursor is not None:
+        global_db.execute_query(
+            "UPDATE state SET last_id = ? WHERE location LIKE ?", [cursor, location]
+        )
+    FFXIV_LOGGER.info(f"Checkpoint saved with {len(fetched)} of {len(pending)} items updated")
+
+
+def update_from_api(location_db, location, start_id, main_config, universalis,
+                    scheduler):  # pylint: disable=too-many-arguments
+    """
+    Main bridge between pulling the sales data and storing it in the database.
+    Fetched items are checkpointed every CheckpointItems items or CheckpointSeconds
+    seconds, so an interrupted run loses at most one checkpoint of work.
+    Returns the item numbers refreshed this cycle.
 
     Parameters:
         location_db : SqlManager
             Database object for performing SQL queries
+        location : str
+            World/DC Location to pull
+        start_id : int
+            Last item ID completed by the sequential update, 0 to start from the beginning
+        main_config : dict
+            Main config values
+        universalis : UniversalisHandler
+            Fetch engine for the Universalis API
+        scheduler : RefreshScheduler
+            Chooses which items are refreshed this cycle
     """
-    for i in range(10):
-        update_list = []
-        numbers = location_db.return_query(f"SELECT number, item_ingredient_{i} FROM recipe")
-        for num in numbers:
-            ingredient_i_id = num[1]
-            if not ingredient_i_id == 0:
-                ave_cost = location_db.return_query(
-                    f"SELECT ave_cost FROM item WHERE item_num = {ingredient_i_id}"
-                )
-                try:
-                    ave_cost = ave_cost[0][0]
-                except IndexError:
-                    ave_cost = 9999999
-                if ave_cost == "None":
-                    ave_cost = 9999999
-                elif ave_cost <= 0:
-                    ave_cost = 9999999
-            else:
-                ave_cost = 0
-            update_list.append(tuple((ave_cost, num[0])))
-        location_db.execute_query_many(
-            f"UPDATE recipe SET ingredient_cost_{i} = ? WHERE number = ?", update_list
-        )
-        FFXIV_LOGGER.info(f"ingredient_cost_{i} updated")
-
+    last_id = location_db.return_query('SELECT item_num FROM item ORDER BY item_num DESC LIMIT 1')
+    last_item = int(last_id[0][0])
+    data = scheduler.select_items(location_db, start_id, int(main_config["update_quantity"]))
 
-def update_cost_to_craft(location_db):
+    item_numbers = [item_number[0] for item_number in data]
+    high_water = get_high_water(location_db, item_numbers)
+    history_state = {
+        item_number: tuple((high_water.get(item_number, 0), history_depth))
+        for item_number, _, history_depth in data
+    }
+    pending = {}
+    # batches finish out of order, the cursor only passes items once all before are done
+    done = set()
+    progress = {"walked": 0, "saved": time.monotonic()}
+
+    def checkpoint():
+        cursor = None
+        if scheduler.refresh_mode == "Sequential" and progress["walked"] > 0:
+            cursor = item_numbers[progress["walked"] - 1]
+            if cursor == last_item:
+                cursor = 0
+        write_checkpoint(location_db, location, pending, cursor)
+        pending.clear()
+        progress["saved"] = time.monotonic()
+
+    def on_history(item_number, history, request_response):
+        sales_dict, new_sales, success = get_sale_nums(item_number, history, request_response)
+        # items Universalis has no data for count as refreshed, failed requests and
+        # unreadable histories are left due so they are tried again
+        refreshed = success == 1 or (success == 0 and request_response is not None)
+        pending[item_number] = (sales_dict if success == 1 else None, new_sales,
+                                int(time.time()) if refreshed else None)
+        done.add(item_number)
+        while progress["walked"] < len(item_numbers) and \
+                item_numbers[progress["walked"]] in done:
+            done.remove(item_numbers[progress["walked"]])
+            progress["walked"] += 1
+        if len(pending) >= main_config["checkpoint_items"] or \
+                time.monotonic() - progress["saved"] >= main_config["checkpoint_seconds"]:
+            checkpoint()
+        return success
+
+    universalis.fetch_histories(item_numbers, location, on_history, history_state)
+    if pending:
+        checkpoint()
+    return item_numbers
+
+
+def update_cost_to_craft(location_db, refreshed=None):
     """
-    Takes the ingredient costs and calculates the item crafting cost.
+    Takes the ingredient sales data and resolves the item crafting costs over the
+    recipe graph, pricing every ingredient at the cheaper of buying and crafting it.
+    Only the items depending on a refreshed item whose price changed are resolved
+    again once the graph has been loaded.
 
     Parameters:
         location_db : SqlManager
             Database object for performing SQL queries
+        refreshed : list[int]
+            Item numbers refreshed since the last update, None to resolve every item
     """
     FFXIV_LOGGER.info("Updating Cost to Craft")
-    location_db.execute_query("UPDATE item "
-                              "SET cost_to_craft = (SELECT recipe.cost_to_craft FROM recipe "
-                              "WHERE recipe.item_result = item.item_num "
-                              "ORDER BY recipe.cost_to_craft DESC LIMIT 1) "
-                              "WHERE item_num IN (SELECT recipe.item_result "
-                              "FROM recipe WHERE recipe.item_result = item.item_num)"
-                              )
+    craft_resolver.resolve(location_db, refreshed)
     FFXIV_LOGGER.info("Cost to Craft Updated")
 
 
-def update(location_db, location, start_id, update_quantity):
+def update(location_db, location, start_id, main_config, universalis,
+           scheduler):  # pylint: disable=too-many-arguments
     """
     Main function to perform all the market cost updating.
 
@@ -269,147 +381,168 @@ def update(location_db, location, start_id, update_quantity):
             Database object for performing SQL queries
         location : str
             World/DC Location to pull
-        start_id : str
-            Which item ID to start the sequential update from
-        update_quantity : int
-            How many items to refresh from the API
+        start_id : int
+            Last item ID completed by the sequential update, 0 to start from the beginning
+        main_config : dict
+            Main config values
+        universalis : UniversalisHandler
+            Fetch engine for the Universalis API
+        scheduler : RefreshScheduler
+            Chooses which items are refreshed this cycle
     """
-    update_from_api(location_db, location, start_id, update_quantity)
+    refreshed = update_from_api(location_db, location, start_id, main_config, universalis,
+                                scheduler)
     FFXIV_LOGGER.info("Sales Data Added to Database")
     print("Sales Data Added to Database")
-    update_ingredient_costs(location_db)
-    FFXIV_LOGGER.info("Ingredient Costs Updated")
-    print("Ingredient Costs Updated")
-    update_cost_to_craft(location_db)
+    update_cost_to_craft(location_db, refreshed)
     FFXIV_LOGGER.info("Cost to Craft Updated")
     print("Cost to Craft Updated")
 
 
-# def profit_table(location_db, location, result_quantity, extra_tables, velocity=10):
-def profit_table(location_db, location, main_config):
+def report_views(location_db, main_config, discord_config):
     """
-    Print the profit tables to the console.
+    Queries each ranking view once, with enough rows for its console table and all of
+    its Discord pages, and returns the MessageBuilder holding each view with the
+    Discord message IDs of its pages.
 
     Parameters:
         location_db : SqlManager
             Database object for performing SQL queries
-        location : str
-            World/DC Location to pull
         main_config : dict
             Main configuration values
+        discord_config : dict
+            Discord configuration values
     """
-    print("\n\n")
-    message_data = MessageBuilder(logging_config)
-    message_data.sql_dict["limit"] = main_config["result_quantity"]
-    message_data.message_data_builder(location_db)
-    message = message_data.message_builder(location)[1]
-    print(message.replace("```", ""))
-    if main_config["extra_tables"]["display_without_craft_cost"]:
+    extra_tables = main_config["extra_tables"]
+    views = [tuple((MessageBuilder(logging_config), discord_config['default_message_ids']))]
+    if extra_tables["display_without_craft_cost"]:
         message_data = MessageBuilder(logging_config)
         message_data.sql_dict["data_type"] = "raw_profit_per_day"
-        message_data.no_craft = main_config["extra_tables"]["display_without_craft_cost"]
-        message_data.sql_dict["limit"] = main_config["result_quantity"]
-        message_data.message_data_builder(location_db)
-        message = message_data.message_builder(location)[1]
-        print(message.replace("```", ""))
-    if main_config["extra_tables"]["gathering_profit_table"]:
+        message_data.no_craft = extra_tables["display_without_craft_cost"]
+        views.append(tuple((message_data, discord_config['no_craft_message_ids'])))
+    if extra_tables["gathering_profit_table"]:
         message_data = MessageBuilder(logging_config)
         message_data.sql_dict["data_type"] = "raw_profit_per_day"
-        message_data.gatherable = main_config["extra_tables"]["gathering_profit_table"]
-        message_data.sql_dict["limit"] = main_config["result_quantity"]
+        message_data.gatherable = extra_tables["gathering_profit_table"]
+        views.append(tuple((message_data, discord_config['gatherable_message_ids'])))
+
+    for message_data, message_ids in views:
+        row_count = main_config["result_quantity"]
+        if discord_config['discord_enable']:
+            # without message IDs a view is posted as a single page
+            row_count = max(row_count, message_data.page_rows_needed(len(message_ids) or 1))
+        message_data.sql_dict["limit"] = row_count
         message_data.message_data_builder(location_db)
-        message = message_data.message_builder(location)[1]
+    return views
+
+
+# def profit_table(location_db, location, result_quantity, extra_tables, velocity=10):
+def profit_table(views, location, main_config):
+    """
+    Print the profit tables to the console.
+
+    Parameters:
+        views : list
+            MessageBuilder of each ranking view with its Discord message IDs
+        location : str
+            World/DC Location to pull
+        main_config : dict
+            Main configuration values
+    """
+    print("\n\n")
+    for message_data, _ in views:
+        message = message_data.message_builder(
+            location, (message_data.results or [])[:main_config["result_quantity"]]
+        )[1]
         print(message.replace("```", ""))
 
 
-def discord_webhook(discord_config, location_db, location, extra_tables):
+def discord_webhook(views, location):
     """
     Function for sending the results to a Discord Webhook.
 
     Parameters:
-        discord_config : dict
-            Discord configuration value
-        location_db : SqlManager
-            Database object for performing SQL queries
+        views : list
+            MessageBuilder of each ranking view with its Discord message IDs
         location : str
             World/DC Location to pull
-        extra_tables : dict
-            Dictionary of bools, whether to include extra profit tables
     """
-    offset = 0
-    message_data_queue = []
-    if len(discord_config['default_message_ids']) == 0:
-        message_data = MessageBuilder(logging_config)
-        message_data_queue.append(message_data)
-    else:
-        offset = 0
-        for message_id in discord_config['default_message_ids']:
-            message_data = MessageBuilder(logging_config)
-            message_data.message_id = message_id
-            message_data.sql_dict["offset"] = offset
-            message_data_queue.append(message_data)
-            offset += 20
-
-    if extra_tables["display_without_craft_cost"] and len(
-            discord_config['no_craft_message_ids']) == 0:
-        message_data = MessageBuilder(logging_config)
-        message_data.sql_dict["data_type"] = "raw_profit_per_day"
-        message_data.no_craft = extra_tables["display_without_craft_cost"]
-        message_data_queue.append(message_data)
-    elif extra_tables["display_without_craft_cost"]:
-        offset = 0
-        for message_id in discord_config['no_craft_message_ids']:
-            message_data = MessageBuilder(logging_config)
-            message_data.message_id = message_id
-            message_data.sql_dict["offset"] = offset
-            message_data.sql_dict["data_type"] = "raw_profit_per_day"
-            message_data.no_craft = extra_tables["display_without_craft_cost"]
-            message_data_queue.append(message_data)
-            offset += 20
-
-    if extra_tables["gathering_profit_table"] and len(
-            discord_config['gatherable_message_ids']) == 0:
-        message_data = MessageBuilder(logging_config)
-        message_data.sql_dict["data_type"] = "raw_profit_per_day"
-        message_data.gatherable = extra_tables["gathering_profit_table"]
-        message_data_queue.append(message_data)
-    elif extra_tables["gathering_profit_table"]:
-        offset = 0
-        for message_id in discord_config['gatherable_message_ids']:
-            message_data = MessageBuilder(logging_config)
-            message_data.message_id = message_id
-            message_data.sql_dict["offset"] = offset
-            message_data.sql_dict["data_type"] = "raw_profit_per_day"
-            message_data.gatherable = extra_tables["gathering_profit_table"]
-            message_data_queue.append(message_data)
-            offset += 20
-
-    discord = DiscordHandler(logging_config)
-    for message_data in message_data_queue:
-        message_data.message_data_builder(location_db)
-        discord.discord_queue_handler(tuple((message_data.message_builder(location))))
+    messages = []
+    for message_data, message_ids in views:
+        messages.extend(message_data.page_messages(location, message_ids or [0]))
+    DiscordHandler(logging_config, global_db).deliver(messages)
 
 
-def main():
-    """Main function"""
-    main_config = config.parse_main_config()
-    endless_loop = main_config["endless_loop"]
+def location_database(main_config):
+    """
+    Returns the configured World/DC location and the path of its market database
+
+    Parameters:
+        main_config : dict
+            Main configuration values
+    """
     marketboard_type = main_config["marketboard_type"]
-    update_quantity = int(main_config["update_quantity"])
-    extra_tables = main_config["extra_tables"]
     location_switch = {
         "World": main_config["world"],
         "Datacentre": main_config["datacentre"],
         "Datacenter": main_config["datacentre"]
     }
     location = location_switch.get(marketboard_type, 'World')
-    market_db_name = os.path.join("databases", marketboard_type + "_" + location)
+    return location, os.path.join("databases", marketboard_type + "_" + location)
+
+
+def export_data(export_format, export_dir, all_locations):
+    """
+    Streams the full item and recipe metrics of the configured location, or of
+    every location database, to files in the given format
+
+    Parameters:
+        export_format : str
+            csv, jsonl or parquet
+        export_dir : str
+            Directory the exported files are written to
+        all_locations : bool
+            Export every location database instead of the configured one
+    """
+    exporter = ExportHandler(logging_config, export_dir, export_format)
+    if all_locations:
+        db_names = ExportHandler.location_databases("databases")
+    else:
+        db_names = [location_database(config.parse_main_config())[1]]
+    for db_name in db_names:
+        if not os.path.exists(db_name):
+            FFXIV_LOGGER.error(f"{db_name} does not exist, nothing to export")
+            continue
+        for path in exporter.export(SqlManager(db_name, {"static": Db_Create.static_db})):
+            print(f"Exported {path}")
+
+
+def refresh_static_data():
+    """
+    Updates the static and global game data in place from the latest source files,
+    the market databases pick up the changed items on their next loop
+    """
+    with ThreadPoolExecutor(max_workers=2) as refresh:
+        refreshes = [refresh.submit(Db_Create, db_name, refresh=True)
+                     for db_name in (Db_Create.static_db, global_db_path)]
+    for db_refresh in refreshes:
+        db_refresh.result()
+    FFXIV_LOGGER.info("Static game data refreshed")
+
+
+def main():
+    """Main function"""
+    main_config = config.parse_main_config()
+    endless_loop = main_config["endless_loop"]
+    marketboard_type = main_config["marketboard_type"]
+    location, market_db_name = location_database(main_config)
 
     try:
         Db_Create(market_db_name)
         FFXIV_LOGGER.info("New World or DC database created")
     except ValueError:
         FFXIV_LOGGER.info("World or DC Database already exists")
+        Db_Create.market_db_upgrade(SqlManager(market_db_name, {"static": Db_Create.static_db}))
 
     selected_location_start_id = global_db.return_query(
         f'SELECT last_id FROM state WHERE '
@@ -424,21 +557,31 @@ def main():
             f'INSERT INTO state (marketboard_type, location, last_id) '
             f'VALUES("{marketboard_type}", "{location}", 0)'
         )
-    location_db = SqlManager(market_db_name)
-
-    update(location_db, location, start_id, update_quantity)
-    if update_quantity == 0:
-        global_db.execute_query(
-            f'UPDATE state SET last_id = 0 WHERE '
-            f'marketboard_type LIKE "{marketboard_type}" AND location LIKE "{location}"'
-        )
+    location_db = SqlManager(market_db_name, {"static": Db_Create.static_db})
+    # the location checkpoint is written with the prices, prefer it to the global mirror
+    checkpoint = location_db.return_query(
+        "SELECT last_id FROM checkpoint WHERE location = ?", [location]
+    )
+    if checkpoint:
+        start_id = int(checkpoint[0][0])
+    universalis = UniversalisHandler(
+        logging_config, main_config["api_concurrency"], main_config["api_rate_limit"],
+        main_config["api_batch_size"]
+    )
+    universalis.api_base = main_config["universalis_url"]
+    scheduler = RefreshScheduler(
+        logging_config, main_config["refresh_mode"],
+        functools.partial(universalis.get_upload_times, location, marketboard_type)
+    )
 
-    profit_table(location_db, location, main_config)
+    update(location_db, location, start_id, main_config, universalis, scheduler)
 
     discord_config = config.parse_discord_config()
+    views = report_views(location_db, main_config, discord_config)
+    profit_table(views, location, main_config)
+
     if discord_config['discord_enable']:
-        discord_webhook(discord_config, location_db,
-                        location, extra_tables)
+        discord_webhook(views, location)
     else:
         FFXIV_LOGGER.info('Discord Disabled in Config')
 
@@ -447,8 +590,30 @@ def main():
 
 
 if __name__ == '__main__':
-    loop = main()
-    while loop:
-        FFXIV_LOGGER.info("Sleeping 10-minutes before next loop begins")
-        time.sleep(300)
+    parser = argparse.ArgumentParser(description="FFXIV Market Calculator")
+    parser.add_argument(
+        "--refresh-static", action="store_true",
+        help="update the game data from the latest datamining files, keeping market data, and exit"
+    )
+    parser.add_argument(
+        "--export", choices=ExportHandler.formats,
+        help="export the full item and recipe metrics of the configured location and exit"
+    )
+    parser.add_argument(
+        "--all-locations", action="store_true",
+        help="with --export, export every World/DC database instead"
+    )
+    parser.add_argument(
+        "--export-dir", default="exports", help="directory to export to (default: exports)"
+    )
+    args = parser.parse_args()
+    if args.refresh_static:
+        refresh_static_data()
+    elif args.export:
+        export_data(args.export, args.export_dir, args.all_locations)
+    else:
         loop = main()
+        while loop:
+            FFXIV_LOGGER.info("Sleeping 10-minutes before next loop begins")
+            time.sleep(300)
+            loop = main()
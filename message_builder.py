@@ -2,12 +2,66 @@
 Module for handling all message building functions for FFXIV-Market-Calculator
 """
 from datetime import datetime
-import pandas as pd
 
 from log_handler import LogHandler
 
 
-class MessageBuilder:  # pylint: disable=too-few-public-methods
+def format_column(values):
+    """
+    Formats the cells of one column, a column holding any float shows every number
+    with the same decimals (1 to 6) the way pandas displays a float column
+    Parameters:
+        values : tuple
+            Values of the column, top to bottom
+    """
+    numbers = [value for value in values if isinstance(value, (int, float))]
+    if any(isinstance(value, float) for value in numbers):
+        decimals = max(
+            max(len(f"{value:.6f}".rstrip("0").split(".")[1]) for value in numbers), 1
+        )
+        return [f"{value:.{decimals}f}" if isinstance(value, (int, float)) else "NaN"
+                for value in values]
+    return ["NaN" if value is None else str(value).replace('"', '') for value in values]
+
+
+def render_table(headers, rows, max_length=None):
+    """
+    Renders rows as a fixed width table, each column right aligned under its header
+    and two spaces from the next. The column widths over each number of rows are
+    measured before rendering, so with a max_length the trailing rows which would
+    not fit are dropped without rendering the table twice.
+    Returns the table and how many of the rows it holds.
+    Parameters:
+        headers : list
+            Column headers
+        rows : list
+            Rows of values, one value per header
+        max_length : int
+            Maximum number of characters of the table, None for no limit
+    """
+    cells = list(zip(*(format_column(column) for column in zip(*rows))))
+    # widths[n] is the width of each column over the headers and the first n rows
+    widths = [[len(header) for header in headers]]
+    for row in cells:
+        widths.append([max(width, len(cell)) for width, cell in zip(widths[-1], row)])
+
+    row_count = len(cells)
+    while max_length is not None and row_count > 0:
+        line_length = sum(widths[row_count]) + 2 * (len(headers) - 1)
+        # every line but the last ends in a new line
+        if (row_count + 1) * (line_length + 1) - 1 <= max_length:
+            break
+        row_count -= 1
+
+    lines = [headers] + [list(row) for row in cells[:row_count]]
+    table = "\n".join(
+        "  ".join(cell.rjust(width) for cell, width in zip(line, widths[row_count]))
+        for line in lines
+    )
+    return table, row_count
+
+
+class MessageBuilder:
     """
     Class for handling the script message building.
 
@@ -17,19 +71,39 @@ class MessageBuilder:  # pylint: disable=too-few-public-methods
         Used for logging functions
     update_time : str
         Data update time
+    columns : list
+        Headers of the table columns, in the order they are queried
+    message_limit : int
+        Maximum number of characters of a Discord message
+    page_rows : int
+        Number of rows shown on each Discord page
+    page_step : int
+        Number of rows from the start of one Discord page to the next
 
     Methods:
     -------
-    message_builder(location, sales_data, no_craft):
+    message_data_builder(location_db):
+        Queries the rows of the ranking view
+    page_rows_needed(page_count):
+        Number of rows to query for the given number of pages
+    message_builder(location, rows):
         Builds a message into the appropriate format
+    page_messages(location, message_ids):
+        Builds one message per page from the queried rows
     """
+    columns = ["Name", "Profit", "Avg-Sales", "Avg-Cost", "Prof-Per-Day", "Avg-Cft-Cost",
+               "Cft-Prof-Day"]
+    message_limit = 2000
+    page_rows = 15
+    page_step = 20
+
     def __init__(self, logging_config):
         self.ffxiv_logger = LogHandler.get_logger(__name__, logging_config)
         self.update_time = datetime.now().strftime('%d/%m/%Y %H:%M')
         self.message_id = 0
         self.sql_dict = {
             "data_type": "craft_profit_per_day",
-            "limit": 15,
+            "limit": self.page_rows,
             "offset": 0
         }
         self.no_craft = False
@@ -48,30 +122,45 @@ class MessageBuilder:  # pylint: disable=too-few-public-methods
         """
         if self.gatherable:
             self.results = location_db.return_query(
-                f'SELECT name, craft_profit, regular_sale_velocity, ave_cost, raw_profit_per_day, '
-                f'cost_to_craft, craft_profit_per_day FROM item WHERE '
-                f'gatherable LIKE "{self.gatherable}" '
+                'SELECT (SELECT name FROM item_info WHERE item_info.item_num = item.item_num), '
+                'craft_profit, regular_sale_velocity, ave_cost, raw_profit_per_day, '
+                'cost_to_craft, craft_profit_per_day FROM item WHERE '
+                "gatherable = 'True' "
                 f'ORDER BY {self.sql_dict["data_type"]} DESC '
                 f'LIMIT {self.sql_dict["limit"]} OFFSET {self.sql_dict["offset"]}'
             )
 
         else:
             self.results = location_db.return_query(
-                f'SELECT name, craft_profit, regular_sale_velocity, ave_cost, raw_profit_per_day, '
-                f'cost_to_craft, craft_profit_per_day FROM item WHERE '
-                f'item_num IN (SELECT item_result FROM recipe WHERE recipe_level_table <= 1000) '
+                'SELECT (SELECT name FROM item_info WHERE item_info.item_num = item.item_num), '
+                'craft_profit, regular_sale_velocity, ave_cost, raw_profit_per_day, '
+                'cost_to_craft, craft_profit_per_day FROM item WHERE '
+                'craftable = 1 '
                 f'ORDER BY {self.sql_dict["data_type"]} DESC '
                 f'LIMIT {self.sql_dict["limit"]} OFFSET {self.sql_dict["offset"]}'
             )
 
-    def message_builder(self, location):
+    def page_rows_needed(self, page_count):
+        """
+        Number of rows to query so every one of the pages can be sliced from them.
+
+        Parameters:
+            page_count : int
+                Number of Discord pages of the view
+        """
+        return self.page_step * (page_count - 1) + self.page_rows
+
+    def message_builder(self, location, rows=None):
         """
         Takes the data and builds message/s for console or Discord.
 
         Parameters:
             location : str
                 World/DC the sales data is for
+            rows : list
+                Rows to show, all of the queried rows when None
         """
+        rows = (self.results or []) if rows is None else rows
         if self.no_craft:
             message_header = (
                 f"*(No Craft Cost)* **Data from {location} @ {self.update_time}**\n```"
@@ -85,8 +174,28 @@ class MessageBuilder:  # pylint: disable=too-few-public-methods
                 f"**Data from {location} @ {self.update_time}**\n```"
             )
         message_footer = "```"
-        to_display = ["Name", "Profit", "Avg-Sales", "Avg-Cost", "Prof-Per-Day", "Avg-Cft-Cost", "Cft-Prof-Day"]
-        frame = pd.DataFrame(self.results)
-        frame.columns = to_display
-        message = message_header + frame.to_string(index=False).replace('"', '') + message_footer
+        table, row_count = render_table(
+            self.columns, rows, self.message_limit - len(message_header) - len(message_footer)
+        )
+        if row_count < len(rows):
+            self.ffxiv_logger.warning(f"Only {row_count} of {len(rows)} rows fit in one message")
+        message = message_header + table + message_footer
         return self.message_id, message
+
+    def page_messages(self, location, message_ids):
+        """
+        Builds the message of each Discord page by slicing the rows queried once for
+        the whole view, page n starts page_step rows after page n-1.
+
+        Parameters:
+            location : str
+                World/DC the sales data is for
+            message_ids : list
+                Discord message ID of each page, in page order
+        """
+        messages = []
+        for page, message_id in enumerate(message_ids):
+            start = page * self.page_step
+            rows = (self.results or [])[start:start + self.page_rows]
+            messages.append(tuple((message_id, self.message_builder(location, rows)[1])))
+        return messages
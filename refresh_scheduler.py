@@ -0,0 +1,177 @@
+"""
+Module for choosing which items to refresh each cycle for FFXIV-Market-Calculator
+"""
+import heapq
+import math
+import time
+
+from log_handler import LogHandler
+
+
+class RefreshScheduler:
+    """
+    Class for handling which items are refreshed from Universalis each cycle.
+
+    Attributes:
+    -------
+    ffxiv_logger : Logger object
+        Used for logging functions
+    refresh_mode : str
+        Sequential walks item IDs from the saved cursor,
+        Priority refreshes the most overdue items first,
+        Changed refreshes only items with new uploads
+    upload_feed : function
+        Returns a dict of item number to latest upload time, used by Changed
+    min_interval : int
+        Shortest refresh interval in seconds, for the busiest and most profitable items
+    max_interval : int
+        Longest refresh interval in seconds, for items which do not sell
+
+    Methods:
+    -------
+    select_items(location_db, start_id, update_quantity):
+        Returns the (item_num, last_sale_time, history_depth) rows to refresh this cycle
+    sequential_items(location_db, start_id, update_quantity):
+        Selects items in ID order after the saved cursor
+    priority_items(location_db, update_quantity):
+        Selects the most overdue items relative to their refresh interval
+    changed_items(location_db, update_quantity):
+        Selects items uploaded to since they were last refreshed
+    refresh_interval(velocity, craft_profit_per_day):
+        Calculates how often an item should be refreshed
+    """
+    min_interval = 900
+    max_interval = 86400 * 7
+
+    def __init__(self, logging_config, refresh_mode="Priority", upload_feed=None):
+        """
+        Constructs all the necessary attributes for the RefreshScheduler object.
+
+        Parameters:
+            logging_config : dict
+                The config for logging
+            refresh_mode : str
+                Sequential, Priority or Changed
+            upload_feed : function
+                Returns a dict of item number to latest upload time, required for Changed
+        """
+        self.ffxiv_logger = LogHandler.get_logger(__name__, logging_config)
+        self.refresh_mode = refresh_mode
+        self.upload_feed = upload_feed
+
+    def select_items(self, location_db, start_id, update_quantity):
+        """
+        Returns the (item_num, last_sale_time, history_depth) rows to refresh this cycle.
+
+        Parameters:
+            location_db : SqlManager
+                Database object for performing SQL queries
+            start_id : int
+                Last item ID completed by the sequential update
+            update_quantity : int
+                How many items to refresh from the API, 0 for all
+        """
+        if self.refresh_mode == "Sequential":
+            return self.sequential_items(location_db, start_id, update_quantity)
+        if self.refresh_mode == "Changed":
+            return self.changed_items(location_db, update_quantity)
+        return self.priority_items(location_db, update_quantity)
+
+    @staticmethod
+    def sequential_items(location_db, start_id, update_quantity):
+        """
+        Selects items in ID order after the saved cursor.
+
+        Parameters:
+            location_db : SqlManager
+                Database object for performing SQL queries
+            start_id : int
+                Last item ID completed by the sequential update
+            update_quantity : int
+                How many items to refresh from the API, 0 for all
+        """
+        if update_quantity == 0:
+            query = f"SELECT item_num, last_sale_time, history_depth FROM item " \
+                    f"WHERE item_num > {start_id}"
+        else:
+            query = f"SELECT item_num, last_sale_time, history_depth FROM item " \
+                    f"WHERE item_num > {start_id} " \
+                    f"ORDER BY item_num ASC LIMIT {update_quantity}"
+        return location_db.return_query(query)
+
+    def priority_items(self, location_db, update_quantity):
+        """
+        Selects the items which are the most overdue relative to their refresh
+        interval, so busy and profitable items are refreshed first.
+
+        Parameters:
+            location_db : SqlManager
+                Database object for performing SQL queries
+            update_quantity : int
+                How many items to refresh from the API, 0 for all
+        """
+        now = time.time()
+        rows = location_db.return_query(
+            "SELECT item_num, last_sale_time, history_depth, regular_sale_velocity, "
+            "craft_profit_per_day, last_refresh FROM item"
+        )
+        staleness = [
+            ((now - (last_refresh or 0)) / self.refresh_interval(velocity, profit_per_day),
+             item_num, last_sale_time, history_depth)
+            for item_num, last_sale_time, history_depth, velocity, profit_per_day, last_refresh
+            in rows
+        ]
+        if update_quantity == 0:
+            selected = sorted(staleness, reverse=True)
+        else:
+            selected = heapq.nlargest(update_quantity, staleness)
+        if selected:
+            self.ffxiv_logger.info(
+                f"Refreshing {len(selected)} items, most overdue at "
+                f"{selected[0][0]:.1f}x its refresh interval"
+            )
+        return [row[1:] for row in selected]
+
+    def changed_items(self, location_db, update_quantity):
+        """
+        Selects the items whose latest upload in the recently updated feeds is newer
+        than the upload stored when they were last refreshed, newest uploads first.
+        Items which have never been refreshed are always included.
+
+        Parameters:
+            location_db : SqlManager
+                Database object for performing SQL queries
+            update_quantity : int
+                How many items to refresh from the API, 0 for all changed items
+        """
+        upload_times = self.upload_feed()
+        rows = location_db.return_query(
+            "SELECT item_num, last_sale_time, history_depth, last_upload_time, last_refresh "
+            "FROM item"
+        )
+        changed = sorted(
+            ((upload_times.get(item_num, 0), item_num, last_sale_time, history_depth)
+             for item_num, last_sale_time, history_depth, last_upload_time, last_refresh in rows
+             if not last_refresh or upload_times.get(item_num, 0) > (last_upload_time or 0)),
+            reverse=True
+        )
+        if update_quantity != 0:
+            changed = changed[:update_quantity]
+        self.ffxiv_logger.info(f"Refreshing {len(changed)} items with new uploads")
+        return [row[1:] for row in changed]
+
+    @classmethod
+    def refresh_interval(cls, velocity, craft_profit_per_day):
+        """
+        Calculates how often an item should be refreshed in seconds, shrinking
+        with its daily sales and with the magnitude of its daily craft profit.
+
+        Parameters:
+            velocity : float
+                Average sales per day
+            craft_profit_per_day : float
+                Stored daily profit from crafting the item
+        """
+        activity = 1 + max(velocity or 0, 0)
+        value = 1 + math.log10(1 + max(craft_profit_per_day or 0, 0))
+        return min(cls.max_interval, max(cls.min_interval, cls.max_interval / (activity * value)))
@@ -1,45 +1,115 @@
 """All SQL related helper functions to be kept here"""
 import sqlite3
+import threading
+from contextlib import contextmanager
 
 
 class SqlManager:
     """
     Class for handling the sql helpers.
 
+    Each thread keeps one long-lived connection to the database, opened on first
+    use with WAL journaling and the tuned pragmas below. Queries run outside of a
+    transaction scope are committed straight away.
+
     Attributes:
     -------
     database : str
         Database path/filename
+    attachments : dict
+        Schema name to the path/filename of each database attached to the connections
+    pragmas : dict
+        Pragmas applied to every new connection
+    _local : threading.local
+        Holds the connection and transaction depth of each thread
 
     Methods:
     -------
     sql_connect():
-        Creates a new Discord Message
+        Returns the connection of the calling thread, opening it if needed
+    transaction():
+        Context manager grouping the queries run inside it into one transaction
+    close():
+        Closes the connection of the calling thread
     execute_query(query, options):
         Helper function for SQL execution when returns are unneeded
     execute_query_many(query, options):
         Helper function for SQL execution when returns are unneeded
     return_query(query, options):
         Helper function for SQL execution when returns are needed
+    stream_query(query, options, chunk_size):
+        Helper function for SQL execution when returns are too many to hold at once
     """
-    def __init__(self, db_name):
+    pragmas = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -65536,  # negative is in KiB, 64MiB
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY"
+    }
+
+    def __init__(self, db_name, attachments=None):
         """
         Constructs all the necessary attributes for the SqlManager object.
 
         Parameters:
             db_name : str
                 Database path/filename
+            attachments : dict
+                Schema name to the path/filename of each database to attach
         """
         self.database = db_name
-        self.sql_connect().close()  # create a new DB if it doesn't exist
+        self.attachments = attachments or {}
+        self._local = threading.local()
+        self.sql_connect()  # create a new DB if it doesn't exist
 
     def sql_connect(self):
         """
-        Performs the database connection
+        Returns the connection of the calling thread, opening it if needed
         """
-        connection = sqlite3.connect(self.database)
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # transactions are opened explicitly, see transaction()
+            connection = sqlite3.connect(self.database, isolation_level=None)
+            for pragma, value in self.pragmas.items():
+                connection.execute(f"PRAGMA {pragma}={value}")
+            for schema, path in self.attachments.items():
+                connection.execute(f"ATTACH DATABASE ? AS {schema}", [path])
+            self._local.connection = connection
+            self._local.depth = 0
         return connection
 
+    @contextmanager
+    def transaction(self):
+        """
+        Context manager grouping the queries run inside it into one transaction,
+        committed on exit and rolled back if an exception escapes it.
+        Nested scopes join the outermost transaction.
+        """
+        connection = self.sql_connect()
+        if self._local.depth == 0:
+            connection.execute("BEGIN")
+        self._local.depth += 1
+        try:
+            yield connection
+        except BaseException:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                connection.rollback()
+            raise
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            connection.commit()
+
+    def close(self):
+        """
+        Closes the connection of the calling thread
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
     def execute_query(self, query, options=[]):
         """
         Helper function for SQL execution when returns are unneeded.
@@ -57,13 +127,12 @@ class SqlManager:
                 cursor.execute(query)
             else:
                 cursor.execute(query, options)
-            connection.commit()
             # print("Query successful")
         except connection.Error as err:
             print(f"Error: '{err}'")
             print(f"Query: {query}")
-        cursor.close()
-        connection.close()
+        finally:
+            cursor.close()
 
     def execute_query_many(self, query, options=[]):
         """
@@ -72,23 +141,21 @@ class SqlManager:
         Parameters:
             query : list
                 SQLite3 queries to run
-            options : list
-                SQLite3 options
+            options : iterable
+                SQLite3 options for each query
         """
         connection = self.sql_connect()
-        cursor = connection.cursor()
-        try:
-            if len(options) == 0:
-                cursor.executemany(query)
-            else:
+        with self.transaction():
+            cursor = connection.cursor()
+            try:
+                # options may be any iterable of rows, consumed as it is inserted
                 cursor.executemany(query, options)
-            connection.commit()
-            # print("Query successful")
-        except connection.Error as err:
-            print(f"Error: '{err}'")
-            print(f"Many Query: {query}")
-        cursor.close()
-        connection.close()
+                # print("Query successful")
+            except connection.Error as err:
+                print(f"Error: '{err}'")
+                print(f"Many Query: {query}")
+            finally:
+                cursor.close()
 
     def return_query(self, query, options=[]):
         """
@@ -112,6 +179,40 @@ class SqlManager:
         except connection.Error as err:
             print(f"Error: '{err}'")
             print(f"Return Query: {query}")
-        cursor.close()
-        connection.close()
+        finally:
+            cursor.close()
         return None
+
+    def stream_query(self, query, options=[], chunk_size=5000):
+        """
+        Helper function for SQL execution when returns are too many to hold at once.
+        Returns the column names and a generator of row chunks read from the cursor
+        as they are consumed.
+
+        Parameters:
+            query : str
+                SQLite3 query to run
+            options : list
+                SQLite3 options
+            chunk_size : int
+                Rows per chunk
+        """
+        connection = self.sql_connect()
+        cursor = connection.cursor()
+        try:
+            cursor.execute(query, options)
+        except connection.Error as err:
+            cursor.close()
+            print(f"Error: '{err}'")
+            print(f"Stream Query: {query}")
+            return [], iter(())
+
+        def chunks():
+            try:
+                rows = cursor.fetchmany(chunk_size)
+                while rows:
+                    yield rows
+                    rows = cursor.fetchmany(chunk_size)
+            finally:
+                cursor.close()
+        return [column[0] for column in cursor.description], chunks()
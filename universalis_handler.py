@@ -0,0 +1,380 @@
+"""
+Module for handling all Universalis api functions for FFXIV-Market-Calculator
+"""
+import asyncio
+import json
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from history_parser import HistoryParser
+from http_handler import HttpHandler
+from log_handler import LogHandler
+
+
+class TokenBucket:  # pylint: disable=too-few-public-methods
+    """
+    Class for sharing one api rate limit between all in-flight requests.
+
+    Attributes:
+    -------
+    rate : float
+        Tokens added to the bucket per second
+    capacity : float
+        Maximum tokens the bucket can hold (burst size)
+    tokens : float
+        Tokens currently available, negative when callers are queued
+    updated : float
+        Monotonic time the bucket was last refilled
+
+    Methods:
+    -------
+    acquire():
+        Waits until a token is available and consumes it
+    """
+    def __init__(self, rate, capacity=None):
+        """
+        Constructs all the necessary attributes for the TokenBucket object.
+
+        Parameters:
+            rate : float
+                Requests allowed per second
+            capacity : float
+                Burst size, defaults to one second worth of requests
+        """
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        """
+        Consumes a token, sleeping until it has been refilled if the bucket is empty.
+        Tokens are reserved before sleeping so concurrent callers queue up in order.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+class UniversalisHandler:
+    """
+    Class for handling the script Universalis api calls.
+
+    Attributes:
+    -------
+    ffxiv_logger : Logger object
+        Used for logging functions
+    concurrency : int
+        Maximum number of requests in flight at once
+    token_bucket : TokenBucket object
+        Rate limiter shared by every request
+    batch_size : int
+        How many item IDs are requested per call
+
+    Methods:
+    -------
+    get_sale_data(item_numbers, location, entries, cutoffs):
+        Calls the Universalis API and returns the data and the response
+    split_history(item_numbers, data):
+        Splits a history response into per-item data
+    history_request(history_state, now):
+        Sizes the entries and window needed to catch up an item
+    is_truncated(data, entries):
+        Whether a history hit the entries limit before covering its window
+    get_history(item_numbers, location, executor, entries, cutoffs):
+        Rate limited fetch of the sale history for a batch of items
+    get_histories(item_numbers, location, executor, entries, cutoffs):
+        Fetches a batch of items, re-fetching any whose depth estimate fell short
+    fetch_histories(item_numbers, location, callback, history_state):
+        Concurrently fetches many items and passes each result to the callback
+    get_upload_times(location, marketboard_type):
+        Retrieves the latest upload times from the recently updated feeds
+    """
+    api_base = "https://universalis.app/api/v2"
+    max_batch_size = 100
+    max_entries = 10000
+    min_entries = 50
+    history_window = 86400 * 28
+    history_overlap = 3600
+    max_feed_entries = 200
+    chunk_size = 65536
+
+    def __init__(self, logging_config, concurrency=8, rate_limit=20, batch_size=100):
+        """
+        Constructs all the necessary attributes for the UniversalisHandler object.
+
+        Parameters:
+            logging_config : dict
+                The config for logging
+            concurrency : int
+                Maximum number of requests in flight at once
+            rate_limit : int
+                Maximum number of requests per second
+            batch_size : int
+                How many item IDs to request per call, Universalis allows up to 100
+        """
+        self.ffxiv_logger = LogHandler.get_logger(__name__, logging_config)
+        self.concurrency = concurrency
+        self.token_bucket = TokenBucket(rate_limit)
+        self.batch_size = max(1, min(batch_size, self.max_batch_size))
+
+    def get_sale_data(self, item_numbers, location, entries=5000, cutoffs=None):
+        """
+        Calls the Universalis API and returns the data and the response. The body is
+        parsed as it streams in, only the sales newer than each item's cutoff are kept.
+
+        Parameters:
+            item_numbers : list[int]
+                Item numbers to pull sales data for
+            location : str
+                World/DC Location to pull
+            entries : int
+                How many Universalis market sale entries to retrieve per item
+            cutoffs : dict
+                Item number to the timestamp at or before which sales are not needed
+        """
+        url = f'{self.api_base}/history/{location}/{",".join(str(i) for i in item_numbers)}' \
+              f'?entriesToReturn={entries}'
+        if cutoffs:
+            within = time.time() - min(cutoffs[item_number] for item_number in item_numbers)
+            url += f'&entriesWithin={max(0, math.ceil(within))}'
+        request_response = HttpHandler.get(url, stream=True)
+        try:
+            parser = HistoryParser(request_response.iter_content(self.chunk_size),
+                                   cutoffs, item_numbers[0])
+            return parser.parse(), request_response
+        except Exception as err:
+            self.ffxiv_logger.error(err)
+            return None, request_response
+        finally:
+            request_response.close()
+
+    @staticmethod
+    def split_history(item_numbers, data):
+        """
+        Splits a history response into a dict of per-item data. Multi-item responses
+        nest each item under "items", items missing from it or listed in
+        "unresolvedItems" are mapped to None.
+
+        Parameters:
+            item_numbers : list[int]
+                Item numbers that were requested
+            data : dict
+                Decoded Universalis history response
+        """
+        if len(item_numbers) == 1:
+            return {item_numbers[0]: data}
+        if not isinstance(data, dict):
+            return {item_number: None for item_number in item_numbers}
+        items = data.get("items") or {}
+        unresolved = set(data.get("unresolvedItems") or [])
+        return {
+            item_number: None if item_number in unresolved else items.get(str(item_number))
+            for item_number in item_numbers
+        }
+
+    def history_request(self, history_state, now):
+        """
+        Sizes the history request needed to catch up an item from its high water mark,
+        the oldest of the newest stored sale of each world, so a Datacentre world
+        uploading after another is still caught up. Returns (entries, within): the
+        depth it last took to cover the 28-day window scaled to the time since that
+        mark, with headroom, and the seconds of history to request. Items without
+        stored sales get the whole 28-day window, the overlap covers sales uploaded
+        late within a world and is de-duplicated when stored. The price is a wider
+        window for items where one world of a Datacentre trades rarely.
+
+        Parameters:
+            history_state : tuple
+                (high_water, history_depth), zeros if the item has no stored sales
+            now : float
+                Current unix time
+        """
+        high_water, history_depth = history_state
+        if not high_water:
+            within = self.history_window
+        else:
+            within = int(min(self.history_window,
+                             max(0, now - high_water) + self.history_overlap))
+        if not history_depth:
+            return self.max_entries, within
+        expected = history_depth * within / self.history_window
+        return min(self.max_entries, int(expected * 2) + self.min_entries), within
+
+    @staticmethod
+    def is_truncated(data, entries):
+        """
+        Whether a history hit the entries limit before reaching its cutoff,
+        meaning sales between the cutoff and its oldest entry are missing.
+
+        Parameters:
+            data : dict
+                Decoded Universalis history for a single item
+            entries : int
+                entriesToReturn used for the request
+        """
+        if not isinstance(data, dict) or data.get("reachedCutoff"):
+            return False
+        return data.get("entryCount", 0) >= entries
+
+    async def get_history(self, item_numbers, location, executor, entries, cutoffs):
+        """
+        Rate limited fetch of the sale history for a batch of items.
+        Returns a dict of item number to (data, request_response).
+
+        Parameters:
+            item_numbers : list[int]
+                Item numbers to pull sales data for
+            location : str
+                World/DC Location to pull
+            executor : ThreadPoolExecutor
+                Executor running the blocking http calls
+            entries : int
+                How many Universalis market sale entries to retrieve per item
+            cutoffs : dict
+                Item number to the timestamp at or before which sales are not needed
+        """
+        loop = asyncio.get_event_loop()
+        await self.token_bucket.acquire()
+        data, request_response = await loop.run_in_executor(
+            executor, self.get_sale_data, item_numbers, location, entries, cutoffs
+        )
+        if request_response.status_code == 404:
+            return {item_number: (None, request_response) for item_number in item_numbers}
+        if not data or not request_response.ok:
+            # a failed or unreadable response says nothing about the items
+            return {item_number: (None, None) for item_number in item_numbers}
+        return {
+            item_number: (item_data, request_response)
+            for item_number, item_data in self.split_history(item_numbers, data).items()
+        }
+
+    async def get_histories(self, item_numbers, location, executor, entries, cutoffs):
+        """
+        Fetches a batch of items sized from their stored history depth. Only if that
+        estimate fell short for some items are those re-fetched at full depth.
+
+        Parameters:
+            item_numbers : list[int]
+                Item numbers to pull sales data for
+            location : str
+                World/DC Location to pull
+            executor : ThreadPoolExecutor
+                Executor running the blocking http calls
+            entries : int
+                How many Universalis market sale entries to retrieve per item
+            cutoffs : dict
+                Item number to the timestamp at or before which sales are not needed
+        """
+        histories = await self.get_history(item_numbers, location, executor, entries, cutoffs)
+        if entries < self.max_entries:
+            truncated = [
+                item_number for item_number, (data, _) in histories.items()
+                if self.is_truncated(data, entries)
+            ]
+            if truncated:
+                self.ffxiv_logger.info(f"History depth too shallow for {truncated}")
+                histories.update(await self.get_history(
+                    truncated, location, executor, self.max_entries, cutoffs
+                ))
+        return histories
+
+    async def _fetch_histories(self, item_numbers, location, callback, history_state):
+        """
+        Coroutine behind fetch_histories, see there for the parameters.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = {}
+        now = time.time()
+        requests_needed = {
+            item_number: self.history_request(history_state.get(item_number, (0, 0)), now)
+            for item_number in item_numbers
+        }
+
+        async def worker(batch):
+            entries = max(requests_needed[item_number][0] for item_number in batch)
+            cutoffs = {item_number: now - requests_needed[item_number][1] for item_number in batch}
+            async with semaphore:
+                try:
+                    histories = await self.get_histories(
+                        batch, location, executor, entries, cutoffs
+                    )
+                except requests.RequestException as err:
+                    self.ffxiv_logger.error(f"{err} w/ item_numbers {batch}")
+                    histories = {item_number: (None, None) for item_number in batch}
+            for item_number in batch:
+                results[item_number] = callback(item_number, *histories[item_number])
+
+        # batch items needing a similar window and depth so one stale or busy item
+        # does not widen the request made for the rest of its batch
+        ordered = sorted(item_numbers, key=lambda item_number: requests_needed[item_number][::-1])
+        batches = [
+            ordered[i:i + self.batch_size] for i in range(0, len(ordered), self.batch_size)
+        ]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            await asyncio.gather(*(worker(batch) for batch in batches))
+        return [results[item_number] for item_number in item_numbers]
+
+    def fetch_histories(self, item_numbers, location, callback, history_state=None):
+        """
+        Concurrently fetches the sale history of many items, batch_size items per
+        request. Only sales newer than each item's high-water mark are requested,
+        sized from how many entries last covered its 28-day window.
+        Each item is handed to the callback as soon as its batch arrives so only the
+        reduced values are kept.
+        Returns the callback results in the same order as item_numbers.
+
+        Parameters:
+            item_numbers : list[int]
+                Item numbers to pull sales data for
+            location : str
+                World/DC Location to pull
+            callback : function
+                Called with (item_number, data, request_response) for each item
+            history_state : dict
+                Item number to (high_water, history_depth) of its stored sales
+        """
+        started = time.monotonic()
+        results = asyncio.run(
+            self._fetch_histories(item_numbers, location, callback, history_state or {})
+        )
+        self.ffxiv_logger.info(
+            f"Fetched {len(item_numbers)} items in {time.monotonic() - started:.1f}s"
+        )
+        return results
+
+    def get_upload_times(self, location, marketboard_type="World"):
+        """
+        Retrieves the most and least recently updated feeds for a location and
+        returns a dict of item number to its latest upload time in milliseconds.
+
+        Parameters:
+            location : str
+                World/DC Location to pull
+            marketboard_type : str
+                World or Datacentre, decides how the location is passed to the feeds
+        """
+        location_param = "world" if marketboard_type == "World" else "dcName"
+        upload_times = {}
+        for feed in ("most-recently-updated", "least-recently-updated"):
+            try:
+                request_response = HttpHandler.get(
+                    f'{self.api_base}/extra/stats/{feed}'
+                    f'?{location_param}={location}&entries={self.max_feed_entries}'
+                )
+                items = json.loads(request_response.content.decode('utf-8'))["items"]
+            except Exception as err:
+                self.ffxiv_logger.error(f"{err} w/ {feed} feed")
+                continue
+            for item in items:
+                item_number = int(item["itemID"])
+                upload_times[item_number] = max(upload_times.get(item_number, 0),
+                                                item["lastUploadTime"])
+        self.ffxiv_logger.info(f"Recently updated feeds listed {len(upload_times)} items")
+        return upload_times